@@ -24,6 +24,12 @@ try:
 except:
     TIPC = False
 
+try:
+    NUMA_NODES = len([n for n in os.listdir('/sys/devices/system/node')
+                      if n.startswith('node') and n[4:].isdigit()]) or 1
+except OSError:
+    NUMA_NODES = 1
+
 try:
     os.stat('/usr/include/pthread.h')
     PTHREADS = True
@@ -0,0 +1,137 @@
+"""
+Process parallel map over named shared memory arrays.
+
+Workers are only sent the segment name and view geometry of the input
+and output arrays ( see shmem.SharedArray ) plus the ranges of rows to
+work on, no array data is ever pickled.
+"""
+
+import os
+import uuid
+from multiprocessing import Pool, cpu_count
+from numpy import ndarray, asarray
+
+from numpush import shmem
+
+try:
+    from numpush.posix_io import numa
+except ImportError:
+    numa = None
+
+# Rows are handed out in chunks of about this many bytes, small enough
+# to stay in cache between reading the input and writing the output
+CHUNK_BYTES = 256 * 1024
+
+# Tasks per worker, chunks are grouped into tasks to balance the load
+# without paying a round trip per chunk
+TASKS_PER_WORKER = 4
+
+def _descriptor(arr):
+    if isinstance(arr, shmem.SharedArray):
+        fn, args = arr.__reduce__()
+        if fn is shmem._attach_view:
+            return args
+    return None
+
+def _temp_name():
+    return 'numpush.%i.%s' % (os.getpid(), uuid.uuid4().hex[:12])
+
+def _pin(arr):
+    # Move the worker onto the node holding the rows it is about to
+    # read, tasks are contiguous runs of chunks so mostly on one node
+    if arr.size:
+        numa.pin_node(numa.node_of(arr.ctypes.data))
+
+def _run(task):
+    func, src, dst, axis, chunks, pin = task
+    src = shmem._attach_view(*src).view(ndarray)
+    dst = shmem._attach_view(*dst).view(ndarray)
+
+    index = [slice(None)] * src.ndim
+    if pin and chunks:
+        index[axis] = slice(*chunks[0])
+        _pin(src[tuple(index)])
+
+    for start, stop in chunks:
+        index[axis] = slice(start, stop)
+        dst[tuple(index)] = func(src[tuple(index)])
+    return len(chunks)
+
+def _split(n, chunksize, ntasks):
+    chunks = [(i, min(i + chunksize, n)) for i in xrange(0, n, chunksize)]
+    per_task = max(1, -(-len(chunks) // ntasks))
+    return [chunks[i:i + per_task] for i in xrange(0, len(chunks), per_task)]
+
+def shared_map(func, array, axis=0, nworkers=None, chunksize=None,
+        out=None, pool=None, pin=None):
+    """
+    Apply ``func`` to chunks of rows of ``array`` along ``axis`` in
+    ``nworkers`` processes, writing into the shared output array.
+
+    ``func`` maps a block of rows to a block of results with one result
+    per row, e.g. ``lambda rows: rows.sum(axis=1)`` and must be
+    picklable. Arrays not already in named shared memory are copied
+    into a temporary segment first. Returns ``out``, which is allocated
+    from the result of ``func`` on the first row when not given.
+
+    With ``pin`` each worker is pinned to the NUMA node holding the
+    rows of its task, by default whenever there is more than one node.
+    """
+    nworkers = nworkers or cpu_count()
+    if pin is None:
+        pin = numa is not None and len(numa.NODES) > 1
+    elif pin and numa is None:
+        raise RuntimeError("NUMA pinning needs numpush.posix_io.numa")
+    n = array.shape[axis]
+    temp = []
+
+    try:
+        src = _descriptor(array)
+        if src is None:
+            name = _temp_name()
+            array = shmem.NamedNumpy(asarray(array), name)
+            temp.append(name)
+            src = _descriptor(array)
+
+        if out is None:
+            index = [slice(None)] * array.ndim
+            index[axis] = slice(0, 1)
+            sample = asarray(func(asarray(array)[tuple(index)]))
+            if sample.ndim <= axis or sample.shape[axis] != 1:
+                raise ValueError("func must return one result per row")
+
+            shape = list(sample.shape)
+            shape[axis] = n
+            name = _temp_name()
+            result = shmem.create(name, shape, sample.dtype)
+            temp.append(name)
+        else:
+            result = out
+        dst = _descriptor(result)
+        if dst is None:
+            raise ValueError("out must be a named shared memory array")
+
+        if chunksize is None:
+            rowbytes = max(array.nbytes // max(n, 1), 1)
+            chunksize = max(1, CHUNK_BYTES // rowbytes)
+
+        tasks = [(func, src, dst, axis, chunks, pin) for chunks in
+                 _split(n, chunksize, nworkers * TASKS_PER_WORKER)]
+
+        if pool is None:
+            workers = Pool(nworkers)
+            try:
+                workers.map(_run, tasks)
+            finally:
+                workers.close()
+                workers.join()
+        else:
+            pool.map(_run, tasks)
+    finally:
+        # The memory stays mapped for as long as we hold on to it
+        for name in temp:
+            shmem.unlink(name)
+
+    if out is None:
+        return result.view(ndarray)
+    return out
@@ -0,0 +1,59 @@
+#if !defined(__linux__)
+#error futex is Linux only
+#endif
+
+#include <stdint.h>
+#include <time.h>
+#include <unistd.h>
+#include <sys/syscall.h>
+#include <linux/futex.h>
+
+/* No FUTEX_PRIVATE_FLAG, the words live in memory shared between
+ * processes */
+
+static inline int futex_wait(uint32_t *addr, uint32_t val,
+                             const struct timespec *timeout)
+{
+    return syscall(SYS_futex, addr, FUTEX_WAIT, val, timeout, NULL, 0);
+}
+
+static inline int futex_wake(uint32_t *addr, int n)
+{
+    return syscall(SYS_futex, addr, FUTEX_WAKE, n, NULL, NULL, 0);
+}
+
+static inline uint32_t atomic_load(uint32_t *addr)
+{
+    return __atomic_load_n(addr, __ATOMIC_SEQ_CST);
+}
+
+static inline void atomic_store(uint32_t *addr, uint32_t val)
+{
+    __atomic_store_n(addr, val, __ATOMIC_SEQ_CST);
+}
+
+static inline int atomic_cas(uint32_t *addr, uint32_t expected, uint32_t val)
+{
+    return __atomic_compare_exchange_n(addr, &expected, val, 0,
+                                       __ATOMIC_SEQ_CST, __ATOMIC_SEQ_CST);
+}
+
+static inline uint32_t atomic_add(uint32_t *addr, uint32_t val)
+{
+    return __atomic_add_fetch(addr, val, __ATOMIC_SEQ_CST);
+}
+
+static inline uint32_t atomic_sub(uint32_t *addr, uint32_t val)
+{
+    return __atomic_sub_fetch(addr, val, __ATOMIC_SEQ_CST);
+}
+
+static inline uint64_t atomic_load64(uint64_t *addr)
+{
+    return __atomic_load_n(addr, __ATOMIC_SEQ_CST);
+}
+
+static inline void atomic_store64(uint64_t *addr, uint64_t val)
+{
+    __atomic_store_n(addr, val, __ATOMIC_SEQ_CST);
+}
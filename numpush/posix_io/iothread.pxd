@@ -0,0 +1,8 @@
+from libc.stdint cimport uint64_t
+
+# IO threads return a pointer to a malloc'd block starting with an
+# iostat, IOThread.join reads the counters out of it and frees it.
+ctypedef struct iostat:
+    uint64_t nbytes
+    uint64_t calls
+    int err
@@ -1,7 +1,9 @@
+import os
 import warnings
+from libc.stdlib cimport free
 
 cdef extern from "pthread.h" nogil:
-    enum: PTHREAD_CANCELED
+    void *PTHREAD_CANCELED
 
     ctypedef unsigned long int pthread_t
     ctypedef union pthread_attr_t:
@@ -17,21 +19,44 @@ cdef class IOThread:
 
     cdef public pthread_t thread
     cdef public int retval
+    cdef public object nbytes
+    cdef public object calls
     cpdef running
     cpdef res
 
     def __cinit__(self, pthread_t thread, *res):
         self.thread = thread
         self.running = True
+        self.retval = 0
+        self.nbytes = 0
+        self.calls = 0
 
         # Associated resources, file descriptors, sockets, memory
         # blocks, etc. Things that need to be cleaned up by proper C
         self.res = res
 
     def join(self):
+        """Wait for the thread to finish, returns 0 or the errno the
+        thread failed with. The byte and syscall counts the thread
+        reported are left in ``nbytes`` and ``calls``."""
+        cdef void *ret = NULL
+        cdef iostat *stat
+        cdef int rc
+
         if self.running:
-            pthread_cancel(self.thread)
+            with nogil:
+                rc = pthread_join(self.thread, &ret)
             self.running = False
+
+            if rc != 0:
+                raise OSError(rc, os.strerror(rc))
+
+            if ret != NULL and ret != PTHREAD_CANCELED:
+                stat = <iostat*>ret
+                self.nbytes = stat.nbytes
+                self.calls = stat.calls
+                self.retval = stat.err
+                free(ret)
         return self.retval
 
     def ensure(self):
@@ -45,5 +70,6 @@ cdef class IOThread:
             raise RuntimeError("IO Thread did not exit cleanly: rc = %i" % rc) 
 
     def __repr__(self):
-        return "<IOThread(%s, %s)>" % (self.thread, self.running)
+        return "<IOThread(%s, %s, %s bytes)>" % (self.thread, self.running,
+                self.nbytes)
 
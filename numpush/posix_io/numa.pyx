@@ -0,0 +1,186 @@
+import os
+import re
+from mmap import PAGESIZE
+
+from libc.stdlib cimport calloc, free
+
+cdef extern from "<sys/syscall.h>" nogil:
+    enum: SYS_mbind
+    enum: SYS_set_mempolicy
+    enum: SYS_get_mempolicy
+    enum: SYS_sched_setaffinity
+    long syscall(long number, ...)
+
+cdef extern from "<linux/mempolicy.h>" nogil:
+    enum: MPOL_DEFAULT
+    enum: MPOL_PREFERRED
+    enum: MPOL_BIND
+    enum: MPOL_INTERLEAVE
+    enum: MPOL_MF_MOVE
+    enum: MPOL_F_NODE
+    enum: MPOL_F_ADDR
+
+cdef extern from "errno.h" nogil:
+    int errno
+
+DEF MASK_WORDS = 16     # 1024 nodes or cpus
+DEF WORD_BITS = 64
+
+POLICIES = {
+    'default'    : MPOL_DEFAULT,
+    'preferred'  : MPOL_PREFERRED,
+    'bind'       : MPOL_BIND,
+    'interleave' : MPOL_INTERLEAVE,
+}
+
+# Topology
+# --------
+
+NODE_DIR = '/sys/devices/system/node'
+
+def _parse_cpulist(cpulist):
+    # "0-3,8-11"
+    cpus = []
+    for part in cpulist.strip().split(','):
+        if not part:
+            continue
+        lo, _, hi = part.partition('-')
+        cpus.extend(range(int(lo), int(hi or lo) + 1))
+    return cpus
+
+def topology():
+    """
+    Map of NUMA node to its cpus, a single node 0 owning every cpu
+    when the kernel exposes no NUMA topology.
+    """
+    nodes = {}
+    try:
+        entries = os.listdir(NODE_DIR)
+    except OSError:
+        entries = []
+
+    for entry in entries:
+        match = re.match(r'node(\d+)$', entry)
+        if not match:
+            continue
+        with open(os.path.join(NODE_DIR, entry, 'cpulist')) as f:
+            nodes[int(match.group(1))] = _parse_cpulist(f.read())
+
+    if not nodes:
+        nodes[0] = range(os.sysconf('SC_NPROCESSORS_ONLN'))
+    return nodes
+
+NODES = topology()
+
+def node_of_cpu(cpu):
+    for node, cpus in NODES.items():
+        if cpu in cpus:
+            return node
+    raise ValueError("No such cpu %r" % cpu)
+
+# Syscalls
+# --------
+
+cdef unsigned long *_mask(bits) except NULL:
+    cdef unsigned long *mask = <unsigned long*>calloc(MASK_WORDS,
+            sizeof(unsigned long))
+    if mask == NULL:
+        raise MemoryError()
+    for bit in bits:
+        if not 0 <= bit < MASK_WORDS * WORD_BITS:
+            free(mask)
+            raise ValueError("Node or cpu %r out of range" % bit)
+        mask[bit // WORD_BITS] |= 1UL << (bit % WORD_BITS)
+    return mask
+
+cdef _check(long ret):
+    if ret == -1:
+        raise OSError(errno, os.strerror(errno))
+
+cdef int _policy(policy) except -1:
+    try:
+        return POLICIES[policy]
+    except KeyError:
+        raise ValueError("Unknown memory policy %r" % policy)
+
+def mbind(array, policy='interleave', nodes=None):
+    """
+    Set the memory policy of the pages backing ``array`` ( any buffer
+    exposing ``__array_interface__`` ), moving pages already touched.
+    ``nodes`` defaults to every node.
+    """
+    cdef unsigned long start, stop
+    cdef unsigned long *mask
+    cdef int mode = _policy(policy)
+    cdef long ret
+
+    iface = array.__array_interface__
+    address = iface['data'][0]
+    nbytes = array.nbytes
+
+    if nodes is None:
+        nodes = NODES.keys()
+    if mode == MPOL_DEFAULT:
+        nodes = []
+
+    start = address // PAGESIZE * PAGESIZE
+    stop = (address + nbytes + PAGESIZE - 1) // PAGESIZE * PAGESIZE
+    if stop == start:
+        return
+
+    mask = _mask(nodes)
+    try:
+        with nogil:
+            ret = syscall(SYS_mbind, <void*>start, stop - start, mode, mask,
+                    <unsigned long>(MASK_WORDS * WORD_BITS + 1),
+                    <unsigned long>MPOL_MF_MOVE)
+        _check(ret)
+    finally:
+        free(mask)
+
+def set_mempolicy(policy='interleave', nodes=None):
+    """
+    Default memory policy for this process' future allocations.
+    """
+    cdef unsigned long *mask
+    cdef int mode = _policy(policy)
+
+    if nodes is None:
+        nodes = NODES.keys()
+    if mode == MPOL_DEFAULT:
+        nodes = []
+
+    mask = _mask(nodes)
+    try:
+        _check(syscall(SYS_set_mempolicy, mode, mask,
+                <unsigned long>(MASK_WORDS * WORD_BITS + 1)))
+    finally:
+        free(mask)
+
+def node_of(address):
+    """
+    Node holding the page at ``address``, faulting it in if needed.
+    """
+    cdef int node = -1
+    cdef unsigned long addr = address
+    _check(syscall(SYS_get_mempolicy, &node, NULL, <unsigned long>0,
+            <void*>addr, <unsigned long>(MPOL_F_NODE | MPOL_F_ADDR)))
+    return node
+
+def sched_setaffinity(cpus, pid=0):
+    """
+    Restrict ``pid`` ( this process by default ) to ``cpus``.
+    """
+    cdef unsigned long *mask = _mask(cpus)
+    try:
+        _check(syscall(SYS_sched_setaffinity, <int>pid,
+                MASK_WORDS * sizeof(unsigned long), mask))
+    finally:
+        free(mask)
+
+def pin_node(node, pid=0):
+    """
+    Restrict ``pid`` ( this process by default ) to the cpus of
+    ``node``.
+    """
+    sched_setaffinity(NODES[node], pid)
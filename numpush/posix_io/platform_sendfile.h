@@ -5,6 +5,18 @@
 #endif
 
 #include <sys/uio.h>
+#include <sys/socket.h>
+#include <netinet/in.h>
+#include <netinet/tcp.h>
+
+/* TCP_NOPUSH is the BSD spelling of TCP_CORK */
+#if !defined(TCP_CORK) && defined(TCP_NOPUSH)
+#define TCP_CORK TCP_NOPUSH
+#endif
+
+#if !defined(MSG_MORE)
+#define MSG_MORE 0
+#endif
 
 struct sf_hdtr {
     struct iovec *headers;
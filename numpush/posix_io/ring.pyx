@@ -0,0 +1,206 @@
+from mmap import mmap, PAGESIZE
+from numpy import ndarray, frombuffer, asarray, uint8, dtype as np_dtype
+
+from libc.stdint cimport uint32_t, uint64_t
+
+cdef extern from "futex.h" nogil:
+    struct timespec:
+        long tv_sec
+        long tv_nsec
+    enum: CLOCK_MONOTONIC
+    int clock_gettime(int clk, timespec *ts)
+
+    int futex_wait(uint32_t *addr, uint32_t val, timespec *timeout)
+    int futex_wake(uint32_t *addr, int n)
+
+    uint32_t atomic_load(uint32_t *addr)
+    void atomic_store(uint32_t *addr, uint32_t val)
+    uint32_t atomic_add(uint32_t *addr, uint32_t val)
+    uint64_t atomic_load64(uint64_t *addr)
+    void atomic_store64(uint64_t *addr, uint64_t val)
+
+cdef extern from "errno.h" nogil:
+    enum: ETIMEDOUT
+
+# Ring Header
+# -----------
+
+# Lives in the first page of the mapping, the records start on the
+# next page. ``head`` is only written by the consumer and ``tail`` only
+# by the producer, each on its own cache line. A side that runs out of
+# records ( or space ) flags itself waiting and sleeps on the other
+# side's sequence word, which is only bumped when somebody is waiting.
+
+ctypedef struct ringhdr:
+    uint64_t head
+    uint32_t space_seq
+    uint32_t pwait
+    char _pad0[48]
+    uint64_t tail
+    uint32_t data_seq
+    uint32_t cwait
+    char _pad1[48]
+
+cdef double _now() nogil:
+    cdef timespec ts
+    clock_gettime(CLOCK_MONOTONIC, &ts)
+    return ts.tv_sec + ts.tv_nsec * 1e-9
+
+cdef inline bint _ready(ringhdr *h, uint64_t capacity, bint producer) nogil:
+    cdef uint64_t filled = atomic_load64(&h.tail) - atomic_load64(&h.head)
+    if producer:
+        return filled < capacity
+    return filled > 0
+
+cdef int _wait(ringhdr *h, uint64_t capacity, bint producer,
+        double deadline) nogil:
+    """Sleep until there is space ( producer ) or records ( consumer ),
+    returns 0 or ETIMEDOUT. A negative deadline waits forever."""
+    cdef uint32_t *seq = &h.space_seq if producer else &h.data_seq
+    cdef uint32_t *waiting = &h.pwait if producer else &h.cwait
+    cdef uint32_t s
+    cdef timespec ts
+    cdef double left
+
+    while not _ready(h, capacity, producer):
+        atomic_store(waiting, 1)
+        s = atomic_load(seq)
+        if not _ready(h, capacity, producer):
+            if deadline < 0:
+                futex_wait(seq, s, NULL)
+            else:
+                left = deadline - _now()
+                if left <= 0:
+                    atomic_store(waiting, 0)
+                    return ETIMEDOUT
+                ts.tv_sec = <long>left
+                ts.tv_nsec = <long>((left - ts.tv_sec) * 1e9)
+                futex_wait(seq, s, &ts)
+        atomic_store(waiting, 0)
+    return 0
+
+cdef inline void _notify(uint32_t *seq, uint32_t *waiting) nogil:
+    if atomic_load(waiting):
+        atomic_add(seq, 1)
+        futex_wake(seq, 1)
+
+cdef double _deadline(timeout):
+    return -1.0 if timeout is None else _now() + max(float(timeout), 0.0)
+
+cdef class SharedRing:
+    """
+    Lock free single producer, single consumer ring of fixed dtype
+    records in shared memory, for handing batches between forked
+    processes without pickling.
+
+    ``push`` copies records in, ``pop`` hands out views onto the ring
+    which stay valid until the next ``pop`` or ``release``.
+    """
+
+    cdef ringhdr *hdr
+    cdef readonly object buffer
+    cdef readonly object dtype
+    cdef readonly uint64_t capacity
+    cdef object records
+    cdef uint64_t popped
+
+    def __cinit__(self, dtype, uint64_t capacity):
+        dtype = np_dtype(dtype)
+        if dtype.hasobject:
+            raise TypeError("Can't share records of dtype %s" % dtype)
+        if capacity < 1:
+            raise ValueError("Capacity must be positive")
+
+        nbytes = dtype.itemsize * capacity
+        size = PAGESIZE + (nbytes + PAGESIZE - 1) // PAGESIZE * PAGESIZE
+        self.buffer = mmap(-1, size)
+
+        view = frombuffer(self.buffer, dtype=uint8, count=sizeof(ringhdr))
+        self.hdr = <ringhdr*><size_t>view.ctypes.data
+        self.records = ndarray.__new__(ndarray, (capacity,), dtype=dtype,
+                buffer=self.buffer, offset=PAGESIZE)
+        self.dtype = dtype
+        self.capacity = capacity
+        self.popped = 0
+
+    def __len__(self):
+        return atomic_load64(&self.hdr.tail) - atomic_load64(&self.hdr.head)
+
+    def push(self, records, timeout=None):
+        """
+        Copy ``records`` into the ring, blocking while it is full.
+        Returns the number of records pushed, short only on timeout.
+        """
+        cdef ringhdr *h = self.hdr
+        cdef uint64_t capacity = self.capacity
+        cdef uint64_t tail, free, start, k, n, done = 0
+        cdef double deadline = -2
+        cdef int err
+
+        records = asarray(records, dtype=self.dtype).reshape(-1)
+        n = len(records)
+
+        while done < n:
+            tail = h.tail
+            free = capacity - (tail - atomic_load64(&h.head))
+            if free == 0:
+                if deadline == -2:
+                    deadline = _deadline(timeout)
+                with nogil:
+                    err = _wait(h, capacity, True, deadline)
+                if err:
+                    break
+                continue
+
+            start = tail % capacity
+            k = min(n - done, free, capacity - start)
+            self.records[start:start + k] = records[done:done + k]
+
+            atomic_store64(&h.tail, tail + k)
+            _notify(&h.data_seq, &h.cwait)
+            done += k
+
+        return done
+
+    def pop(self, n=None, timeout=None):
+        """
+        View onto the next records, at most ``n``, blocking until there
+        is at least one. Fewer come back when the records wrap around
+        the end of the ring, and none on timeout.
+        """
+        cdef ringhdr *h = self.hdr
+        cdef uint64_t capacity = self.capacity
+        cdef uint64_t head, avail, start, k
+        cdef double deadline
+        cdef int err
+
+        self.release()
+
+        head = h.head
+        avail = atomic_load64(&h.tail) - head
+        if avail == 0:
+            deadline = _deadline(timeout)
+            with nogil:
+                err = _wait(h, capacity, False, deadline)
+            if err:
+                return self.records[:0]
+            avail = atomic_load64(&h.tail) - head
+
+        start = head % capacity
+        k = min(avail, capacity - start)
+        if n is not None:
+            k = min(k, n)
+
+        self.popped = k
+        return self.records[start:start + k]
+
+    def release(self):
+        """
+        Give the records handed out by the last ``pop`` back to the
+        producer.
+        """
+        cdef ringhdr *h = self.hdr
+        if self.popped:
+            atomic_store64(&h.head, h.head + self.popped)
+            self.popped = 0
+            _notify(&h.space_seq, &h.pwait)
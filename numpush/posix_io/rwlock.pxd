@@ -0,0 +1,14 @@
+from libc.stdint cimport uint32_t
+
+# Reader-writer lock state, 16 bytes that can be placed anywhere in
+# shared memory ( 4 byte aligned ). All zeros is an unlocked lock.
+ctypedef struct rwlock_t:
+    uint32_t state      # reader count | RW_WRITER
+    uint32_t writers    # writers waiting to get in
+    uint32_t waiters    # threads asleep on seq
+    uint32_t seq        # futex word, bumped on every wakeup
+
+cdef int rw_rdlock(rwlock_t *l, double timeout) nogil
+cdef int rw_wrlock(rwlock_t *l, double timeout) nogil
+cdef void rw_rdunlock(rwlock_t *l) nogil
+cdef void rw_wrunlock(rwlock_t *l) nogil
@@ -0,0 +1,388 @@
+import os
+from mmap import mmap, PAGESIZE
+from numpy import frombuffer, uint8
+
+from libc.stdint cimport uint32_t
+from posix.unistd cimport getpid
+
+cdef extern from "futex.h" nogil:
+    struct timespec:
+        long tv_sec
+        long tv_nsec
+    enum: CLOCK_MONOTONIC
+    int clock_gettime(int clk, timespec *ts)
+
+    int futex_wait(uint32_t *addr, uint32_t val, timespec *timeout)
+    int futex_wake(uint32_t *addr, int n)
+
+    uint32_t atomic_load(uint32_t *addr)
+    void atomic_store(uint32_t *addr, uint32_t val)
+    bint atomic_cas(uint32_t *addr, uint32_t expected, uint32_t val)
+    uint32_t atomic_add(uint32_t *addr, uint32_t val)
+    uint32_t atomic_sub(uint32_t *addr, uint32_t val)
+
+cdef extern from "errno.h" nogil:
+    enum: ETIMEDOUT
+
+cdef extern from "pthread.h" nogil:
+    ctypedef unsigned long int pthread_t
+    pthread_t pthread_self()
+
+cdef enum:
+    RW_WRITER = 1 << 30
+    WAKE_ALL  = 0x7fffffff
+
+# Lock Primitives
+# ---------------
+
+# The fast paths are a single compare and swap on ``state``, the futex
+# is only touched when somebody has to sleep ( ``waiters`` is non zero ).
+# Sleepers wait on ``seq`` which every wakeup bumps, so a wakeup between
+# checking the lock and going to sleep is never lost. Readers stay out
+# while any writer is waiting so writers can't be starved.
+
+cdef double _now() nogil:
+    cdef timespec ts
+    clock_gettime(CLOCK_MONOTONIC, &ts)
+    return ts.tv_sec + ts.tv_nsec * 1e-9
+
+cdef int _sleep(rwlock_t *l, uint32_t seq, double deadline) nogil:
+    cdef timespec ts
+    cdef double left
+
+    if deadline < 0:
+        futex_wait(&l.seq, seq, NULL)
+        return 0
+
+    left = deadline - _now()
+    if left <= 0:
+        return ETIMEDOUT
+    ts.tv_sec = <long>left
+    ts.tv_nsec = <long>((left - ts.tv_sec) * 1e9)
+    futex_wait(&l.seq, seq, &ts)
+    return 0
+
+cdef inline void _wake(rwlock_t *l) nogil:
+    atomic_add(&l.seq, 1)
+    if atomic_load(&l.waiters):
+        futex_wake(&l.seq, WAKE_ALL)
+
+cdef inline bint _rdblocked(rwlock_t *l, uint32_t state) nogil:
+    return (state & RW_WRITER) or atomic_load(&l.writers) != 0
+
+cdef inline bint _tryrdlock(rwlock_t *l) nogil:
+    cdef uint32_t s = atomic_load(&l.state)
+    return not _rdblocked(l, s) and atomic_cas(&l.state, s, s + 1)
+
+cdef int rw_rdlock(rwlock_t *l, double timeout) nogil:
+    """Take a read lock, returns 0 or ETIMEDOUT. A negative timeout
+    waits forever."""
+    cdef uint32_t s, seq
+    cdef double deadline = -1
+    cdef int err
+
+    while True:
+        s = atomic_load(&l.state)
+        if not _rdblocked(l, s):
+            if atomic_cas(&l.state, s, s + 1):
+                return 0
+            continue
+
+        if timeout >= 0 and deadline < 0:
+            deadline = _now() + timeout
+
+        atomic_add(&l.waiters, 1)
+        seq = atomic_load(&l.seq)
+        err = 0
+        if _rdblocked(l, atomic_load(&l.state)):
+            err = _sleep(l, seq, deadline)
+        atomic_sub(&l.waiters, 1)
+        if err:
+            return err
+
+cdef int rw_wrlock(rwlock_t *l, double timeout) nogil:
+    """Take the write lock, returns 0 or ETIMEDOUT. A negative timeout
+    waits forever."""
+    cdef uint32_t seq
+    cdef double deadline = -1
+    cdef int err
+
+    if atomic_cas(&l.state, 0, RW_WRITER):
+        return 0
+
+    atomic_add(&l.writers, 1)
+    if timeout >= 0:
+        deadline = _now() + timeout
+
+    while True:
+        if atomic_cas(&l.state, 0, RW_WRITER):
+            atomic_sub(&l.writers, 1)
+            return 0
+
+        atomic_add(&l.waiters, 1)
+        seq = atomic_load(&l.seq)
+        err = 0
+        if atomic_load(&l.state) != 0:
+            err = _sleep(l, seq, deadline)
+        atomic_sub(&l.waiters, 1)
+
+        if err:
+            # Let in the readers we were holding off
+            atomic_sub(&l.writers, 1)
+            _wake(l)
+            return err
+
+cdef void rw_rdunlock(rwlock_t *l) nogil:
+    # Only a writer can be waiting on readers
+    if atomic_sub(&l.state, 1) == 0 and atomic_load(&l.writers):
+        _wake(l)
+
+cdef void rw_wrunlock(rwlock_t *l) nogil:
+    atomic_store(&l.state, 0)
+    _wake(l)
+
+# Python Interface
+# ----------------
+
+cdef _timeout(timeout):
+    return -1.0 if timeout is None else max(float(timeout), 0.0)
+
+cdef class RWLock:
+    """
+    Writer preferring reader-writer lock in shared memory. By default
+    it lives in its own anonymous shared mapping and works across
+    forked processes, pass ``buffer`` ( and ``offset`` ) to place it in
+    any other writable shared memory, e.g. a named segment.
+
+    ``with lock:`` reads, ``with lock.writing():`` writes. Write locks
+    nest, and the thread holding the write lock may also read.
+    """
+
+    cdef rwlock_t *lock
+    cdef readonly object buffer
+    cdef pthread_t owner
+    cdef int depth
+    cdef int pid
+
+    def __cinit__(self, buffer=None, offset=0):
+        if buffer is None:
+            buffer = mmap(-1, PAGESIZE)
+
+        view = frombuffer(buffer, dtype=uint8, count=sizeof(rwlock_t),
+                offset=offset)
+        if not view.flags.writeable:
+            raise ValueError("Lock needs writable memory")
+        if view.ctypes.data % 4:
+            raise ValueError("Lock needs 4 byte aligned memory")
+
+        self.lock = <rwlock_t*><size_t>view.ctypes.data
+        self.buffer = buffer
+        self.depth = 0
+
+    cdef inline bint _mine(self):
+        return self.depth > 0 and self.owner == pthread_self() \
+            and self.pid == getpid()
+
+    def acquire_read(self, timeout=None):
+        cdef double t
+        cdef int err
+
+        if self.depth and self._mine():
+            return True
+        if _tryrdlock(self.lock):
+            return True
+
+        t = _timeout(timeout)
+        with nogil:
+            err = rw_rdlock(self.lock, t)
+        return err == 0
+
+    def release_read(self):
+        if self.depth and self._mine():
+            return
+        rw_rdunlock(self.lock)
+
+    def acquire_write(self, timeout=None):
+        cdef double t
+        cdef int err
+
+        if self.depth and self._mine():
+            self.depth += 1
+            return True
+
+        if not atomic_cas(&self.lock.state, 0, RW_WRITER):
+            t = _timeout(timeout)
+            with nogil:
+                err = rw_wrlock(self.lock, t)
+            if err:
+                return False
+
+        self.owner = pthread_self()
+        self.pid = getpid()
+        self.depth = 1
+        return True
+
+    def release_write(self):
+        if not self._mine():
+            raise RuntimeError("Write lock not held by this thread")
+        self.depth -= 1
+        if self.depth == 0:
+            rw_wrunlock(self.lock)
+
+    acquire = acquire_read
+    release = release_read
+
+    def __enter__(self):
+        self.acquire_read()
+
+    def __exit__(self, *args):
+        self.release_read()
+
+    def reading(self, timeout=None):
+        return _Guard(self, False, timeout)
+
+    def writing(self, timeout=None):
+        return _Guard(self, True, timeout)
+
+    property readers:
+        def __get__(self):
+            return atomic_load(&self.lock.state) & ~RW_WRITER
+
+    property locked:
+        def __get__(self):
+            return bool(atomic_load(&self.lock.state) & RW_WRITER)
+
+cdef class _Guard:
+
+    cdef RWLock lock
+    cdef bint write
+    cdef object timeout
+
+    def __cinit__(self, RWLock lock, bint write, timeout):
+        self.lock = lock
+        self.write = write
+        self.timeout = timeout
+
+    def __enter__(self):
+        if self.write:
+            ok = self.lock.acquire_write(self.timeout)
+        else:
+            ok = self.lock.acquire_read(self.timeout)
+        if not ok:
+            raise OSError(ETIMEDOUT, os.strerror(ETIMEDOUT))
+
+    def __exit__(self, *args):
+        if self.write:
+            self.lock.release_write()
+        else:
+            self.lock.release_read()
+
+# Striped Locks
+# -------------
+
+# One rwlock per stripe, each on its own cache line so writers to
+# neighbouring stripes don't bounce the same line between cores.
+# Ranges of stripes are always taken in ascending order so overlapping
+# ranges can't deadlock.
+
+DEF STRIPE_STRIDE = 64
+
+cdef class StripedLock:
+    """
+    ``nstripes`` reader-writer locks in shared memory, locked a
+    contiguous range at a time.
+    """
+
+    cdef char *locks
+    cdef readonly int nstripes
+    cdef readonly object buffer
+
+    def __cinit__(self, int nstripes, buffer=None, offset=0):
+        if nstripes < 1:
+            raise ValueError("Need at least one stripe")
+        size = nstripes * STRIPE_STRIDE
+
+        if buffer is None:
+            buffer = mmap(-1, (size + PAGESIZE - 1) // PAGESIZE * PAGESIZE)
+
+        view = frombuffer(buffer, dtype=uint8, count=size, offset=offset)
+        if not view.flags.writeable:
+            raise ValueError("Lock needs writable memory")
+        if view.ctypes.data % 4:
+            raise ValueError("Lock needs 4 byte aligned memory")
+
+        self.locks = <char*><size_t>view.ctypes.data
+        self.nstripes = nstripes
+        self.buffer = buffer
+
+    cdef inline rwlock_t *_stripe(self, int i) nogil:
+        return <rwlock_t*>(self.locks + i * STRIPE_STRIDE)
+
+    cdef int _check(self, int lo, int hi) except -1:
+        if lo < 0 or hi >= self.nstripes or lo > hi:
+            raise IndexError("Stripes %i-%i out of range" % (lo, hi))
+        return 0
+
+    def acquire(self, int lo, int hi, bint write=False, timeout=None):
+        """
+        Lock stripes ``lo`` through ``hi`` inclusive, all or nothing.
+        The ``timeout`` bounds the whole range, not each stripe.
+        """
+        cdef double t = _timeout(timeout)
+        cdef double deadline = -1
+        cdef int i, err = 0
+        self._check(lo, hi)
+
+        with nogil:
+            if t >= 0:
+                deadline = _now() + t
+            for i in range(lo, hi + 1):
+                # Each stripe only gets what is left of the timeout
+                if deadline >= 0:
+                    t = max(deadline - _now(), 0.0)
+                if write:
+                    err = rw_wrlock(self._stripe(i), t)
+                else:
+                    err = rw_rdlock(self._stripe(i), t)
+                if err:
+                    break
+            if err:
+                self._unlock(lo, i - 1, write)
+        return err == 0
+
+    cdef void _unlock(self, int lo, int hi, bint write) nogil:
+        cdef int i
+        for i in range(hi, lo - 1, -1):
+            if write:
+                rw_wrunlock(self._stripe(i))
+            else:
+                rw_rdunlock(self._stripe(i))
+
+    def release(self, int lo, int hi, bint write=False):
+        self._check(lo, hi)
+        self._unlock(lo, hi, write)
+
+    def locked(self, int lo, int hi, bint write=False, timeout=None):
+        return _StripeGuard(self, lo, hi, write, timeout)
+
+cdef class _StripeGuard:
+
+    cdef StripedLock lock
+    cdef int lo, hi
+    cdef bint write
+    cdef object timeout
+
+    def __cinit__(self, StripedLock lock, int lo, int hi, bint write,
+            timeout):
+        self.lock = lock
+        self.lo = lo
+        self.hi = hi
+        self.write = write
+        self.timeout = timeout
+
+    def __enter__(self):
+        if not self.lock.acquire(self.lo, self.hi, self.write, self.timeout):
+            raise OSError(ETIMEDOUT, os.strerror(ETIMEDOUT))
+
+    def __exit__(self, *args):
+        self.lock.release(self.lo, self.hi, self.write)
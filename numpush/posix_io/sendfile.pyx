@@ -1,9 +1,15 @@
 #from libc.stdio cimport printf
 from libc.stdint cimport uint32_t, uint64_t
+from libc.stdlib cimport malloc, free
+from libc.string cimport memset
+from cpython cimport PyObject_GetBuffer, PyBuffer_Release, PyBUF_SIMPLE
 
 import os
 import sys
-from mmap import PAGESIZE
+from io import BytesIO
+from mmap import PAGESIZE, ALLOCATIONGRANULARITY
+from numpy import memmap, frombuffer
+from numpy.lib import format
 
 cdef extern from "platform_sendfile.h" nogil:
     ctypedef signed off_t
@@ -14,8 +20,33 @@ cdef extern from "platform_sendfile.h" nogil:
     ssize_t sendfile_linux(int out_fd, int in_fd, uint64_t *offset, size_t nbytes)
     ssize_t sendfile_bsd(int fd, int s, uint64_t *offset, size_t len, sf_hdtr *hdtr, int flags)
 
+    struct iovec:
+        void *iov_base
+        size_t iov_len
+
+    struct msghdr:
+        iovec *msg_iov
+        size_t msg_iovlen
+
+    enum: IPPROTO_TCP
+    enum: TCP_CORK
+    enum: MSG_MORE
+
+    ssize_t sendmsg(int sockfd, msghdr *msg, int flags)
+    int setsockopt(int sockfd, int level, int optname, void *optval,
+                   unsigned int optlen)
+
+cdef extern from "poll.h" nogil:
+    struct pollfd:
+        int fd
+        short events
+        short revents
+    enum: POLLOUT
+    int poll(pollfd *fds, unsigned long nfds, int timeout)
+
 cdef extern from "errno.h" nogil:
     enum: EAGAIN
+    enum: EINTR
     #enum: EWOULDBLOCK
     enum: EBADF
     enum: EFAULT
@@ -23,6 +54,7 @@ cdef extern from "errno.h" nogil:
     enum: EIO
     enum: ENOMEM
     enum: EBUSY
+    enum: ETIMEDOUT
 
     enum: SF_NODISKIO
     enum: SF_MNOWAIT
@@ -67,11 +99,21 @@ cdef int _posix_sendfile(int fdout, int fdin, uint64_t *offset, size_t nbytes):
                 sent = ret
         return sent
 
-def posix_sendfile(sock, fd, offset=0, nbytes=PAGESIZE):
+# With headers or trailers the whole range is sent, see
+# posix_sendfile_chunk, and the total bytes put on the socket returned.
+def posix_sendfile(sock, fd, offset=0, nbytes=PAGESIZE, headers=None,
+        trailers=None):
     cdef uint64_t c_offset = offset
     cdef size_t c_count = nbytes
     cdef int rc
 
+    if headers or trailers:
+        end = posix_sendfile_chunk(sock, fd, offset, nbytes,
+                headers=headers, trailers=trailers)
+        return (end - offset
+            + sum(len(h) for h in headers or ())
+            + sum(len(t) for t in trailers or ()))
+
     rc = _posix_sendfile(sock.fileno(), fd.fileno(), &c_offset, nbytes)
 
     if rc < 0:
@@ -79,5 +121,278 @@ def posix_sendfile(sock, fd, offset=0, nbytes=PAGESIZE):
     else:
         return rc
 
-def posix_sendfile_chunk():
-    pass
+# Chunked Transfers
+# =================
+
+CHUNKSIZE = 16*1024*1024
+
+class SendfileError(OSError):
+    """
+    sendfile failed part way through a transfer, ``offset`` is where
+    the transfer should be resumed from.
+    """
+
+    def __init__(self, errno, strerror, offset):
+        OSError.__init__(self, errno, strerror)
+        self.offset = offset
+
+cdef int _wait_writable(int fd, int timeout):
+    cdef pollfd pfd
+    cdef int rc
+    global errno
+
+    pfd.fd = fd
+    pfd.events = POLLOUT
+    pfd.revents = 0
+
+    with nogil:
+        rc = poll(&pfd, 1, timeout)
+        if rc == -1:
+            rc = -errno
+            errno = 0
+    return rc
+
+# Headers and Trailers
+# ====================
+
+# On Linux the socket is corked around the whole transfer so the
+# headers, the file payload and the trailers are coalesced into full
+# TCP segments, instead of the headers going out as a packet of their
+# own. Sockets that can't be corked ( unix sockets ) just get the
+# headers with MSG_MORE.
+
+cdef int _set_cork(int fd, int on):
+    return setsockopt(fd, IPPROTO_TCP, TCP_CORK, &on, sizeof(int))
+
+cdef int _sendmsg_all(int fd, object bufs, int flags, int timeout,
+        uint64_t offset) except -1:
+    """Gather write ``bufs`` to ``fd``, resuming partial writes. On
+    EAGAIN waits up to ``timeout`` ms, raising SendfileError at the
+    file ``offset`` on expiry."""
+    cdef Py_ssize_t n = len(bufs)
+    cdef Py_ssize_t i, acquired = 0
+    cdef iovec *iov
+    cdef Py_buffer *views
+    cdef msghdr msg
+    cdef ssize_t sent
+    cdef int err, rc
+    global errno
+
+    if n == 0:
+        return 0
+
+    iov = <iovec*>malloc(n * sizeof(iovec))
+    views = <Py_buffer*>malloc(n * sizeof(Py_buffer))
+    if iov == NULL or views == NULL:
+        free(iov)
+        free(views)
+        raise MemoryError()
+
+    try:
+        for i in range(n):
+            PyObject_GetBuffer(bufs[i], &views[i], PyBUF_SIMPLE)
+            acquired += 1
+            iov[i].iov_base = views[i].buf
+            iov[i].iov_len = views[i].len
+
+        memset(&msg, 0, sizeof(msghdr))
+        msg.msg_iov = iov
+        msg.msg_iovlen = n
+
+        while msg.msg_iovlen:
+            with nogil:
+                sent = sendmsg(fd, &msg, flags)
+                err = errno
+                errno = 0
+
+            if sent < 0:
+                if err == EINTR:
+                    continue
+                elif err == EAGAIN:
+                    rc = _wait_writable(fd, timeout)
+                    if rc == 0:
+                        raise SendfileError(ETIMEDOUT, os.strerror(ETIMEDOUT),
+                                offset)
+                    elif rc < 0 and rc != -EINTR:
+                        raise SendfileError(-rc, os.strerror(-rc), offset)
+                    continue
+                raise OSError(err, os.strerror(err))
+
+            # Skip the fully written buffers and trim a partial one
+            while msg.msg_iovlen and <size_t>sent >= msg.msg_iov[0].iov_len:
+                sent -= msg.msg_iov[0].iov_len
+                msg.msg_iov += 1
+                msg.msg_iovlen -= 1
+            if msg.msg_iovlen:
+                msg.msg_iov[0].iov_base = <char*>msg.msg_iov[0].iov_base + sent
+                msg.msg_iov[0].iov_len -= sent
+    finally:
+        for i in range(acquired):
+            PyBuffer_Release(&views[i])
+        free(iov)
+        free(views)
+    return 0
+
+def _fileno(f):
+    if type(f) is int:
+        return f
+    return f.fileno()
+
+def posix_sendfile_chunk(sock, fd, offset=0, nbytes=None,
+        chunksize=CHUNKSIZE, progress=None, timeout=-1, headers=None,
+        trailers=None):
+    """
+    Send ``nbytes`` of ``fd`` starting at ``offset`` ( by default the
+    rest of the file ) over ``sock``, looping sendfile until done.
+
+    Partial writes are resumed, and on a non-blocking socket EAGAIN
+    waits up to ``timeout`` milliseconds for the socket to become
+    writable ( -1 waits forever ). ``progress`` is called with
+    (offset, remaining) after every chunk.
+
+    ``headers`` and ``trailers`` are lists of buffers written in full
+    before and after the file data, in the same TCP segments as it. A
+    timeout while writing them raises SendfileError.
+
+    Returns the file offset reached, when it falls short of the end of
+    the range ( timeout, or the file ended early ) a later call resumes
+    the transfer from there.
+    """
+    cdef int c_out = _fileno(sock)
+    cdef int c_in = _fileno(fd)
+    cdef uint64_t c_offset = offset
+    cdef uint64_t start, end
+    cdef size_t c_chunk = chunksize
+    cdef int c_timeout = timeout
+    cdef int rc
+    cdef bint corked = False
+
+    if nbytes is None:
+        nbytes = os.fstat(c_in).st_size - offset
+    end = offset + nbytes
+
+    if headers or trailers:
+        corked = _set_cork(c_out, 1) == 0
+
+    try:
+        if headers:
+            _sendmsg_all(c_out, headers, MSG_MORE, c_timeout, c_offset)
+        c_offset = _sendfile_loop(c_out, c_in, c_offset, end, c_chunk,
+                progress, c_timeout)
+        if trailers and c_offset == end:
+            _sendmsg_all(c_out, trailers, 0, c_timeout, c_offset)
+    finally:
+        if corked:
+            _set_cork(c_out, 0)
+
+    return c_offset
+
+cdef uint64_t _sendfile_loop(int c_out, int c_in, uint64_t c_offset,
+        uint64_t end, size_t c_chunk, object progress,
+        int c_timeout) except? 0:
+    cdef uint64_t start
+    cdef int rc
+
+    while c_offset < end:
+        start = c_offset
+        rc = _posix_sendfile(c_out, c_in, &c_offset,
+                min(c_chunk, end - c_offset))
+
+        if rc > 0:
+            c_offset = start + rc
+            if progress is not None:
+                progress(c_offset, end - c_offset)
+        elif rc == 0:
+            # File is shorter than the requested range
+            break
+        elif rc == -EINTR:
+            c_offset = start
+        elif rc == -EAGAIN:
+            c_offset = start
+            rc = _wait_writable(c_out, c_timeout)
+            if rc == 0:
+                break
+            elif rc < 0 and rc != -EINTR:
+                raise SendfileError(-rc, os.strerror(-rc), c_offset)
+        else:
+            raise SendfileError(-rc, os.strerror(-rc), start)
+
+    return c_offset
+
+# Memory Mapped Arrays
+# ====================
+
+# A memmapped array is sent as a .npy stream, the standard npy header
+# ( dtype, shape, order ) followed by the raw data straight out of the
+# page cache. The peer can write it to disk and np.load it with
+# mmap_mode, or use recv_memmap to receive straight into a memmap.
+
+def npy_header(arr):
+    buf = BytesIO()
+    format.write_array_header_1_0(buf, format.header_data_from_array_1_0(arr))
+    header = buf.getvalue()
+    # Older numpy leaves the magic string to the caller
+    if not header.startswith(format.MAGIC_PREFIX):
+        header = format.magic(1, 0) + header
+    return header
+
+def _file_offset(mm):
+    # The mmap starts on the allocation granularity boundary below the
+    # memmap offset and is shared by all views of the memmap
+    start = mm.offset - mm.offset % ALLOCATIONGRANULARITY
+    base = frombuffer(mm._mmap, dtype='B').ctypes.data
+    return start + mm.ctypes.data - base
+
+def posix_sendfile_array(sock, mm, chunksize=CHUNKSIZE, progress=None):
+    """
+    Send a np.memmap array, header and data, over ``sock``.
+    """
+    if not isinstance(mm, memmap) or getattr(mm, '_mmap', None) is None:
+        raise TypeError("%r is not a file backed np.memmap" % type(mm))
+    if not (mm.flags.c_contiguous or mm.flags.f_contiguous):
+        raise ValueError("memmap is not contiguous")
+
+    header = npy_header(mm)
+
+    with open(mm.filename, 'rb') as fd:
+        offset = _file_offset(mm)
+        end = posix_sendfile_chunk(sock, fd, offset, mm.nbytes,
+                chunksize, progress, headers=[header])
+
+    if end != offset + mm.nbytes:
+        raise SendfileError(EAGAIN, "Transfer incomplete", end)
+    return len(header) + mm.nbytes
+
+def _recv_exactly(sock, n):
+    buf = bytearray(n)
+    view = memoryview(buf)
+    while n:
+        got = sock.recv_into(view[len(buf) - n:], n)
+        if got == 0:
+            raise EOFError("Connection closed")
+        n -= got
+    return bytes(buf)
+
+def recv_memmap(sock, filename):
+    """
+    Receive a ``posix_sendfile_array`` stream into a new .npy file at
+    ``filename`` and return it as a writable memmap.
+    """
+    preamble = _recv_exactly(sock, format.MAGIC_LEN + 2)
+    fp = BytesIO(preamble)
+    format.read_magic(fp)
+    hlen = ord(preamble[-2]) | ord(preamble[-1]) << 8
+    fp = BytesIO(preamble[-2:] + _recv_exactly(sock, hlen))
+    shape, fortran_order, dtype = format.read_array_header_1_0(fp)
+
+    mm = format.open_memmap(filename, mode='w+', dtype=dtype, shape=shape,
+            fortran_order=fortran_order)
+
+    view = memoryview(mm.reshape(-1, order='A').view('B'))
+    n = 0
+    while n < mm.nbytes:
+        got = sock.recv_into(view[n:], mm.nbytes - n)
+        if got == 0:
+            raise EOFError("Connection closed")
+        n += got
+    return mm
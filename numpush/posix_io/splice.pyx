@@ -6,10 +6,13 @@ from libc.stdint cimport uint32_t, uint64_t
 from libc.stdlib cimport malloc, free
 from libc.stdio cimport printf
 from posix.unistd cimport pipe, close
+from cpython cimport PyObject_GetBuffer, PyBuffer_Release, \
+    PyBUF_ANY_CONTIGUOUS
 
 from mmap import PAGESIZE
 
 from iothread import IOThread
+from numpush.posix_io.iothread cimport iostat
 
 cdef extern from "pthread.h" nogil:
     enum: PTHREAD_CANCEL_ASYNCHRONOUS
@@ -33,13 +36,36 @@ cdef extern from "fcntl.h" nogil:
     enum: SPLICE_F_MORE
     enum: SPLICE_F_GIFT
 
+    struct iovec:
+        void *iov_base
+        size_t iov_len
+
+    ssize_t vmsplice(int fd, iovec *iov, unsigned long nr_segs,
+            unsigned int flags)
+
+    enum: F_SETPIPE_SZ
+    enum: F_GETPIPE_SZ
+    int fcntl(int fd, int cmd, int arg)
+
+cdef extern from "poll.h" nogil:
+    struct pollfd:
+        int fd
+        short events
+        short revents
+    enum: POLLIN
+    enum: POLLOUT
+    int poll(pollfd *fds, unsigned long nfds, int timeout)
+
 cdef extern from "errno.h" nogil:
+    enum: EAGAIN
+    enum: EINTR
     enum: SF_NODISKIO
     enum: SF_MNOWAIT
     enum: SF_SYNC
     int errno
 
 ctypedef struct spliceinfo:
+    iostat stat
     int fd1
     int fd2
     uint64_t fd1_offset
@@ -119,9 +145,14 @@ cdef void* pthread_splice(void *p) nogil:
     global errno
 
     rc = splice(fd_in, NULL, fd_out, NULL, nbytes, flags)
-    free(pms);
+    pms.stat.calls = 1
+    if rc < 0:
+        pms.stat.err = errno
+    else:
+        pms.stat.nbytes = rc
 
-    return NULL
+    # Freed by IOThread.join
+    return <void*>pms
 
 # Spin a raw OS thread (no GIL!) to do background continuous data
 # transfer between two file descriptors. The POSIX thread also
@@ -141,6 +172,9 @@ def posix_splice_thread(fd1, fd2, fd1_offset=0, fd2_offset=0,
 
     cdef pthread_t thread
     cdef spliceinfo *pms = <spliceinfo*>malloc(sizeof(spliceinfo))
+    pms.stat.nbytes = 0
+    pms.stat.calls = 0
+    pms.stat.err = 0
     pms.fd1 = fd1
     pms.fd2 = fd2
     pms.fd1_offset = fd1_offset
@@ -178,75 +212,318 @@ def posix_splice_fork(fd1, fd2, fd1_offset=0, fd2_offset=0,
     else:
         return pid
 
-cdef long splice_chunk(int pipe_fd, int fd_out, size_t nbytes, int flags):
-    # Splice from the pipe until the data is depeleted
-
-    cdef int calls = 0
-    cdef long written = 1
-    cdef long total = 0
+# Relay
+# =====
+
+#                 Unix Pipe
+#           +-------------------+
+# fd_in => fd[1] => Splice => fd[0] => fd_out
+
+# Splice two arbitrary file descriptors ( most often sockets ) together
+# through an intermediary unix pipe until EOF on fd_in. A unix pipe is
+# ostensibly an in-kernel buffer between two arbitrary points so we
+# still maintain zero-copy like behavior, and the whole loop runs
+# without the GIL.
+
+# The default pipe capacity on Linux
+RELAY_CHUNK = 16*PAGESIZE
+
+ctypedef struct relayinfo:
+    iostat stat
+    int fd_in
+    int fd_out
+    size_t chunk
+    unsigned int flags
+
+cdef int _wait_fd(int fd, short events) nogil:
+    cdef pollfd pfd
+    pfd.fd = fd
+    pfd.events = events
+    pfd.revents = 0
+    return poll(&pfd, 1, -1)
+
+cdef int _relay(int fd_in, int fd_out, size_t chunk, unsigned int flags,
+        iostat *stat) nogil:
+    cdef int pipefd[2]
+    cdef ssize_t n, m
+    cdef int err = 0
 
-    while written > 0:
-        written = splice(pipe_fd, NULL, fd_out, NULL, nbytes, flags)
+    if pipe(pipefd) < 0:
+        stat.err = errno
+        return stat.err
 
-        if written < 0:
-            raise IOError("Couldn't splice")
+    flags |= SPLICE_F_MORE | SPLICE_F_MOVE
 
-        calls += 1
-        total += written
+    while err == 0:
+        n = splice(fd_in, NULL, pipefd[1], NULL, chunk, flags)
+        if n == 0:
+            break
+        elif n < 0:
+            if errno == EINTR:
+                continue
+            elif errno == EAGAIN:
+                _wait_fd(fd_in, POLLIN)
+                continue
+            err = errno
+            break
+        stat.calls += 1
+
+        # Drain everything moved into the pipe, the output may take it
+        # in several partial moves
+        while n > 0:
+            m = splice(pipefd[0], NULL, fd_out, NULL, n, flags)
+            if m < 0:
+                if errno == EINTR:
+                    continue
+                elif errno == EAGAIN:
+                    _wait_fd(fd_out, POLLOUT)
+                    continue
+                err = errno
+                break
+            stat.calls += 1
+            stat.nbytes += m
+            n -= m
 
-    return (total, calls)
+    close(pipefd[0])
+    close(pipefd[1])
+    stat.err = err
+    return err
 
-cdef long splice_sockets(int sock1, int sock2, int flags):
-    #                 Unix Pipe
-    #           +-------------------+
-    # sock1 => fd[0] => Splice => fd[1] => sock2
+cdef void* pthread_relay(void *p) nogil:
+    cdef relayinfo *info = <relayinfo*>(p)
+    _relay(info.fd_in, info.fd_out, info.chunk, info.flags, &info.stat)
 
-    # Splice two sockets using the splice() calls using an
-    # intermediary unix pipe.
+    # Freed by IOThread.join
+    return <void*>info
 
-    # A unix pipe is ostensibly a in-kernel buffer between two arbitrary
-    # points so we still maintain zero-copy like behavior.
+def posix_splice_relay(fd1, fd2, chunksize=RELAY_CHUNK, flags=0):
+    """
+    Relay everything from fd1 to fd2 until EOF on fd1, returns the
+    number of bytes moved and the number of splice calls made.
+    """
+    if type(fd1) is not int:
+        fd1 = fd1.fileno()
 
-    cdef int pipefd[2]
-    cdef uint64_t *start = <uint64_t*>0
-    cdef size_t size = 8194
+    if type(fd2) is not int:
+        fd2 = fd2.fileno()
 
-    cdef unsigned int status = 0
-    cdef unsigned long copied = 0
-    cdef ssize_t nr
-    cdef int ret
+    cdef iostat stat
+    cdef int c_fd1 = fd1
+    cdef int c_fd2 = fd2
+    cdef size_t c_chunk = chunksize
+    cdef unsigned int c_flags = flags
     cdef int rc
 
-    rc = pipe(pipefd)
-
-    flags |= SPLICE_F_MORE | SPLICE_F_MOVE
+    stat.nbytes = 0
+    stat.calls = 0
+    stat.err = 0
 
-    while 1:
-        nr = splice(sock1, NULL, pipefd[1], NULL, size, flags)
-        if nr <= 0:
-            ret = nr
-            #break
-        while nr:
-            ret = splice(pipefd[0], NULL, sock2, NULL, nr, flags)
-            if ret <= 0:
-                break
-            nr -= ret
+    with nogil:
+        rc = _relay(c_fd1, c_fd2, c_chunk, c_flags, &stat)
 
-    close(pipefd[0])
-    close(pipefd[1])
-    return ret
+    if rc != 0:
+        raise OSError(rc, os.strerror(rc))
+    return stat.nbytes, stat.calls
 
-def posix_splice_sockets(fd1, fd2, flags=0):
+def posix_splice_relay_thread(fd1, fd2, chunksize=RELAY_CHUNK, flags=0):
+    """
+    Run the relay on a raw OS thread, joining the returned IOThread
+    waits for EOF and leaves the byte and call counts on it.
+    """
     if type(fd1) is not int:
         fd1 = fd1.fileno()
 
     if type(fd2) is not int:
         fd2 = fd2.fileno()
 
-    cdef int c_flags = flags
+    cdef pthread_t thread
+    cdef int rc
+    cdef relayinfo *info = <relayinfo*>malloc(sizeof(relayinfo))
+    if info == NULL:
+        raise MemoryError()
+
+    info.stat.nbytes = 0
+    info.stat.calls = 0
+    info.stat.err = 0
+    info.fd_in = fd1
+    info.fd_out = fd2
+    info.chunk = chunksize
+    info.flags = flags
+
+    with nogil:
+        rc = pthread_create(&thread, NULL, pthread_relay, <void*>info)
 
-    rc = splice_sockets(fd1, fd2, flags)
+    if rc != 0:
+        free(info)
+        raise OSError(rc, os.strerror(rc))
 
-    if rc < 0:
-        raise OSError(os.strerror(errno))
-    return rc
+    io = IOThread(thread, fd1, fd2)
+    atexit.register(io.ensure)
+    return io
+
+def posix_splice_sockets(fd1, fd2, flags=0):
+    return posix_splice_relay(fd1, fd2, flags=flags)
+
+# vmsplice
+# ========
+
+# vmsplice maps user memory ( e.g. a numpy buffer ) into a pipe without
+# copying it, from there splice moves it on to a socket. The pages are
+# referenced, not copied, until the data has left the machine so the
+# array must not be modified or freed in the meantime. Gifting
+# (SPLICE_F_GIFT) hands whole pages over to the kernel instead, which
+# requires them to be page aligned both in address and length.
+
+cdef int _vmsplice_all(int fd, char *buf, size_t nbytes, unsigned int flags,
+        iostat *stat) nogil:
+    cdef iovec iov
+    cdef ssize_t n
+
+    iov.iov_base = buf
+    iov.iov_len = nbytes
+
+    while iov.iov_len:
+        n = vmsplice(fd, &iov, 1, flags)
+        if n < 0:
+            if errno == EINTR:
+                continue
+            elif errno == EAGAIN and not flags & SPLICE_F_NONBLOCK:
+                _wait_fd(fd, POLLOUT)
+                continue
+            stat.err = errno
+            return stat.err
+        stat.calls += 1
+        stat.nbytes += n
+        iov.iov_base = <char*>iov.iov_base + n
+        iov.iov_len -= n
+    return 0
+
+cdef int _drain(int pipe_out, int fd_out, ssize_t n, unsigned int flags,
+        iostat *stat) nogil:
+    cdef ssize_t m
+    while n > 0:
+        m = splice(pipe_out, NULL, fd_out, NULL, n, flags)
+        if m < 0:
+            if errno == EINTR:
+                continue
+            elif errno == EAGAIN:
+                _wait_fd(fd_out, POLLOUT)
+                continue
+            return errno
+        stat.calls += 1
+        stat.nbytes += m
+        n -= m
+    return 0
+
+cdef int _vmsplice_send(char *buf, size_t nbytes, int fd_out, size_t chunk,
+        bint gift, size_t pagesize, iostat *stat) nogil:
+    cdef int pipefd[2]
+    cdef size_t offset = 0
+    cdef ssize_t n, size
+    cdef unsigned int flags
+    cdef int err = 0
+    cdef iovec iov
+
+    if pipe(pipefd) < 0:
+        stat.err = errno
+        return stat.err
+
+    # Grow the pipe so a whole chunk fits, then clamp the chunk to what
+    # the pipe really holds less a page, an unaligned chunk straddles
+    # one more page than it is long and every page takes a pipe slot
+    fcntl(pipefd[1], F_SETPIPE_SZ, chunk + pagesize)
+    size = fcntl(pipefd[1], F_GETPIPE_SZ, 0)
+    if size > <ssize_t>pagesize:
+        chunk = min(chunk, <size_t>size - pagesize)
+    else:
+        chunk = min(chunk, pagesize)
+
+    while offset < nbytes and err == 0:
+        iov.iov_base = buf + offset
+        iov.iov_len = min(chunk, nbytes - offset)
+
+        flags = 0
+        if gift and iov.iov_len % pagesize == 0 \
+                and (<size_t>iov.iov_base) % pagesize == 0:
+            flags = SPLICE_F_GIFT
+
+        n = vmsplice(pipefd[1], &iov, 1, flags)
+        if n < 0:
+            if errno == EINTR:
+                continue
+            err = errno
+            break
+        stat.calls += 1
+
+        # Empty the pipe after every vmsplice, partial or not, so the
+        # next one always finds it empty and can never block on it
+        flags = SPLICE_F_MOVE
+        if offset + n < nbytes:
+            flags |= SPLICE_F_MORE
+        err = _drain(pipefd[0], fd_out, n, flags, stat)
+        offset += n
+
+    close(pipefd[0])
+    close(pipefd[1])
+    stat.err = err
+    return err
+
+def posix_vmsplice(array, fd, flags=0):
+    """
+    Map the buffer of ``array`` into the pipe ``fd`` without copying
+    it, returns the number of bytes moved. With SPLICE_NONBLOCK this
+    may be less than the whole buffer.
+    """
+    if type(fd) is not int:
+        fd = fd.fileno()
+
+    cdef Py_buffer view
+    cdef iostat stat
+    cdef int c_fd = fd
+    cdef unsigned int c_flags = flags
+    cdef int rc
+
+    stat.nbytes = 0
+    stat.calls = 0
+    stat.err = 0
+
+    PyObject_GetBuffer(array, &view, PyBUF_ANY_CONTIGUOUS)
+    with nogil:
+        rc = _vmsplice_all(c_fd, <char*>view.buf, view.len, c_flags, &stat)
+    PyBuffer_Release(&view)
+
+    if rc != 0 and not (rc == EAGAIN and c_flags & SPLICE_F_NONBLOCK):
+        raise OSError(rc, os.strerror(rc))
+    return stat.nbytes
+
+def posix_vmsplice_send(array, sock, gift=False, chunksize=RELAY_CHUNK):
+    """
+    Send the buffer of ``array`` to ``sock`` with no userspace copy,
+    vmsplicing it into a pipe and splicing the pipe into the socket.
+    With ``gift`` the page aligned pages are gifted to the kernel.
+    Returns the number of bytes sent and the number of syscalls made.
+    """
+    if type(sock) is not int:
+        sock = sock.fileno()
+
+    cdef Py_buffer view
+    cdef iostat stat
+    cdef int c_fd = sock
+    cdef size_t c_chunk = chunksize
+    cdef bint c_gift = gift
+    cdef size_t c_pagesize = PAGESIZE
+    cdef int rc
+
+    stat.nbytes = 0
+    stat.calls = 0
+    stat.err = 0
+
+    PyObject_GetBuffer(array, &view, PyBUF_ANY_CONTIGUOUS)
+    with nogil:
+        rc = _vmsplice_send(<char*>view.buf, view.len, c_fd, c_chunk, c_gift,
+                c_pagesize, &stat)
+    PyBuffer_Release(&view)
+
+    if rc != 0:
+        raise OSError(rc, os.strerror(rc))
+    return stat.nbytes, stat.calls
@@ -1,10 +1,12 @@
+import struct
 from io import BytesIO
 from array import array
 from imp import new_module
 from StringIO import StringIO
 
 try:
-    from numpy import dtype, frombuffer
+    from numpy import dtype, frombuffer, ascontiguousarray, ndarray, \
+        byte_bounds, empty, ndindex
 except ImportError:
     have_numpy = False
 
@@ -57,20 +59,256 @@ except:
 
 def numpy_reduce(nd):
     dtype_name = nd.dtype.name   # string
-    shape      = nd.values.shape # tuple
+    shape      = nd.shape        # tuple
 
     # Pandas ndarray
     nd = nd
     md = (shape, dtype_name)
     return md, nd
 
+# ``nd`` is anything exposing the buffer interface, either a string or a
+# zmq.Frame when received with copy=False. In the latter case the array
+# is built directly on the frame's memory and the frame is kept alive as
+# the array base, the array is then read-only.
 def numpy_reconstruct(md, nd):
-    index, columns, dtype_name, shape = md
-    buf = buffer(nd)
-
-    ndarray = frombuffer(buf, dtype=dtype(dtype_name)).reshape(shape)
+    shape, dtype_name = md
+    ndarray = frombuffer(nd, dtype=dtype(dtype_name)).reshape(shape)
     return ndarray
 
+# Numpy Wire Header
+# =================
+
+# A fixed layout, versioned binary header describing an array completely,
+# decoded with nothing but struct.unpack:
+#
+#   [ magic 'NW' ][ version ][ flags ][ order ][ ndim ][ descr length ]
+#   [ payload nbytes ][ offset of the first element in the payload ]
+#   [ shape, ndim int64 ][ strides, ndim int64 ][ dtype descriptor ]
+#
+# The dtype descriptor is a table, one entry per ( sub ) dtype:
+#
+#   simple   : [ 0 ][ length H ][ dtype.str, e.g. '<f8', '<M8[ns]' ]
+#   struct   : [ 1 ][ nfields H ][ itemsize Q ]
+#              nfields * [ name length H ][ offset Q ][ name ][ entry ]
+#   subarray : [ 2 ][ ndim B ][ shape ndim * Q ][ base entry ]
+#
+# Any array whose elements fill their memory block without gaps ( C or
+# Fortran order, transposes, reversed views ) goes out as that block
+# with no copy, the strides rebuild the view on the other side. Arrays
+# with gaps arrive compacted in the same memory order.
+
+WIRE_MAGIC   = b'NW'
+WIRE_VERSION = 1
+WIRE_HEADER  = struct.Struct('<2sBBcBHQQ')
+
+# Header flags
+WIRE_PACKED = 0x01   # the sender had to copy the array to send it
+WIRE_RUNS   = 0x02   # the payload is split into one frame per run
+
+# Arrays with gaps between their elements go out as their contiguous
+# runs when those are long enough to be worth a frame each ( a frame
+# costs about as much as copying WIRE_FRAME_COST bytes ), otherwise the
+# elements are packed into a new block.
+WIRE_FRAME_COST = 16 * 1024
+WIRE_MAX_RUNS   = 4096
+
+DT_SIMPLE   = 0
+DT_STRUCT   = 1
+DT_SUBARRAY = 2
+
+_DT_SIMPLE   = struct.Struct('<BH')
+_DT_STRUCT   = struct.Struct('<BHQ')
+_DT_FIELD    = struct.Struct('<HQ')
+_DT_SUBARRAY = struct.Struct('<BB')
+
+def dtype_encode(dt):
+    if dt.hasobject:
+        raise TypeError("Can't put dtype %s on the wire" % dt)
+
+    if dt.subdtype is not None:
+        base, shape = dt.subdtype
+        return _DT_SUBARRAY.pack(DT_SUBARRAY, len(shape)) + \
+            struct.pack('<%iQ' % len(shape), *shape) + dtype_encode(base)
+
+    if dt.names is not None:
+        parts = [_DT_STRUCT.pack(DT_STRUCT, len(dt.names), dt.itemsize)]
+        for name in dt.names:
+            fdt, offset = dt.fields[name][:2]
+            name = name.encode('utf-8')
+            parts.append(_DT_FIELD.pack(len(name), offset))
+            parts.append(name)
+            parts.append(dtype_encode(fdt))
+        return b''.join(parts)
+
+    s = dt.str.encode('ascii')
+    return _DT_SIMPLE.pack(DT_SIMPLE, len(s)) + s
+
+def dtype_decode(buf, pos=0):
+    """
+    Decode the dtype entry at ``pos``, returns the dtype and the
+    position just past it.
+    """
+    kind = ord(buf[pos:pos + 1])
+
+    if kind == DT_SIMPLE:
+        _, n = _DT_SIMPLE.unpack_from(buf, pos)
+        pos += _DT_SIMPLE.size
+        return dtype(buf[pos:pos + n]), pos + n
+
+    if kind == DT_STRUCT:
+        _, nfields, itemsize = _DT_STRUCT.unpack_from(buf, pos)
+        pos += _DT_STRUCT.size
+        names, formats, offsets = [], [], []
+        for i in range(nfields):
+            n, offset = _DT_FIELD.unpack_from(buf, pos)
+            pos += _DT_FIELD.size
+            names.append(buf[pos:pos + n])
+            pos += n
+            fdt, pos = dtype_decode(buf, pos)
+            formats.append(fdt)
+            offsets.append(offset)
+        return dtype({'names': names, 'formats': formats,
+                      'offsets': offsets, 'itemsize': itemsize}), pos
+
+    if kind == DT_SUBARRAY:
+        _, ndim = _DT_SUBARRAY.unpack_from(buf, pos)
+        pos += _DT_SUBARRAY.size
+        shape = struct.unpack_from('<%iQ' % ndim, buf, pos)
+        pos += 8 * ndim
+        base, pos = dtype_decode(buf, pos)
+        return dtype((base, shape)), pos
+
+    raise ValueError("Unknown dtype table entry %i" % kind)
+
+def _dense(nd):
+    # A view onto the array's memory block in C order, or None when
+    # the elements don't fill the block ( gaps or broadcasting )
+    lo, hi = byte_bounds(nd)
+    if hi - lo != nd.nbytes:
+        return None
+
+    axes = sorted(range(nd.ndim), key=lambda i: -abs(nd.strides[i]))
+    block = nd.transpose(axes)
+    for i in range(block.ndim):
+        if block.strides[i] < 0:
+            index = [slice(None)] * block.ndim
+            index[i] = slice(None, None, -1)
+            block = block[tuple(index)]
+    if not block.flags.c_contiguous:
+        return None
+    return block
+
+def _runs(nd):
+    # Depth of the leading axes ( in memory order ) to iterate over so
+    # that what is left is contiguous, None if any stride isn't positive
+    if any(stride <= 0 for stride in nd.strides):
+        return None
+    for k in range(nd.ndim + 1):
+        if nd[(0,) * k + (Ellipsis,)].flags.c_contiguous:
+            return k
+
+def numpy_header_reduce(nd, flags=0):
+    """
+    Binary wire header and payload frames for ``nd``. The payload is the
+    array's own memory whenever its layout allows, otherwise either its
+    contiguous runs ( one frame each ) or a packed copy.
+    """
+    block = _dense(nd)
+    if block is not None:
+        if nd.flags.c_contiguous:
+            order = b'C'
+        elif nd.flags.f_contiguous:
+            order = b'F'
+        else:
+            order = b'A'
+        shape, strides = nd.shape, nd.strides
+        offset = nd.ctypes.data - byte_bounds(nd)[0]
+        frames = [block]
+    else:
+        # Lay the elements out compactly in the array's own memory order
+        axes = sorted(range(nd.ndim), key=lambda i: -abs(nd.strides[i]))
+        oriented = nd.transpose(axes)
+
+        compact = [0] * nd.ndim
+        stride = nd.itemsize
+        for i in reversed(range(nd.ndim)):
+            compact[axes[i]] = stride
+            stride *= oriented.shape[i]
+
+        if axes == sorted(axes):
+            order = b'C'
+        elif axes == sorted(axes, reverse=True):
+            order = b'F'
+        else:
+            order = b'A'
+        shape, strides, offset = nd.shape, tuple(compact), 0
+
+        k = _runs(oriented)
+        nruns = 1
+        for n in oriented.shape[:k or 0]:
+            nruns *= n
+
+        if k is not None and nruns <= WIRE_MAX_RUNS and \
+                oriented[(0,) * k + (Ellipsis,)].nbytes >= WIRE_FRAME_COST:
+            frames = [oriented[index] for index in ndindex(*oriented.shape[:k])]
+            flags |= WIRE_RUNS
+        else:
+            frames = [ascontiguousarray(oriented)]
+            flags |= WIRE_PACKED
+
+    descr = dtype_encode(nd.dtype)
+    header = WIRE_HEADER.pack(WIRE_MAGIC, WIRE_VERSION, flags, order,
+        nd.ndim, len(descr), nd.nbytes, offset)
+    header += struct.pack('<%iq' % (2 * nd.ndim), *(shape + strides))
+
+    # As raw bytes, not every dtype can be exported as a buffer
+    return header + descr, [f.reshape(-1).view('B') for f in frames]
+
+def numpy_header_decode(header):
+    """
+    Unpack a wire header, returns (flags, order, shape, strides, dtype,
+    nbytes, offset).
+    """
+    magic, version, flags, order, ndim, dlen, nbytes, offset = \
+        WIRE_HEADER.unpack_from(header, 0)
+    if magic != WIRE_MAGIC:
+        raise ValueError("Not a numpush wire header")
+    if version > WIRE_VERSION:
+        raise ValueError("Unsupported wire header version %i" % version)
+
+    pos = WIRE_HEADER.size
+    dims = struct.unpack_from('<%iq' % (2 * ndim), header, pos)
+    pos += 16 * ndim
+    dt, end = dtype_decode(header[pos:pos + dlen])
+    return flags, order, dims[:ndim], dims[ndim:], dt, nbytes, offset
+
+def numpy_header_reconstruct(header, frames):
+    """
+    Rebuild the array from its header and payload frames, a single
+    frame is used in place, runs are gathered into a new block.
+    """
+    flags, order, shape, strides, dt, nbytes, offset = \
+        numpy_header_decode(header)
+
+    if not isinstance(frames, (list, tuple)):
+        nd = frames
+    elif len(frames) == 1:
+        nd = frames[0]
+    else:
+        nd = empty(nbytes, dtype='B')
+        pos = 0
+        for frame in frames:
+            run = frombuffer(frame, dtype='B')
+            nd[pos:pos + len(run)] = run
+            pos += len(run)
+        nd = nd[:pos]
+
+    if len(nd) != nbytes:
+        raise ValueError("Payload is %i bytes, header says %i" %
+            (len(nd), nbytes))
+    return ndarray(shape, dtype=dt, buffer=nd, offset=offset,
+        strides=strides)
+
 # Pandas
 # ======
 
@@ -82,8 +320,9 @@ def pandas_reduce(df):
     dtype_name = df.values.dtype.name # string
     shape      = df.values.shape      # tuple
 
-    # Pandas ndarray
-    nd = df.values
+    # Pandas ndarray, the block manager hands back a Fortran ordered
+    # view so it has to be laid out in C order before it hits the wire
+    nd = ascontiguousarray(df.values)
     md = (shape, dtype_name, index, columns)
     return md, nd
 
@@ -91,7 +330,7 @@ def pandas_reconstruct(md, nd):
     shape, ndtype, index, columns = md
     ndarray = frombuffer(nd, dtype=dtype(ndtype)).reshape(shape)
     return DataFrame(data=ndarray, index=index,
-            columns=columns, dtype=None)
+            columns=columns, dtype=None, copy=False)
 
 def pandasts_reduce(df):
     index  = df.index.tolist()    # list
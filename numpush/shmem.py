@@ -1,6 +1,14 @@
-from numpy import ndarray, byte_bounds
-from pandas import DataFrame
+import os
+import mmap
+import struct
+import ctypes
+from numpy import ndarray, byte_bounds, dtype as np_dtype, asarray
+from numpy.lib.format import dtype_to_descr
+from numpy.lib.utils import safe_eval
+from pandas import DataFrame, Index, DatetimeIndex, MultiIndex
+from pandas.core.internals import BlockManager, make_block
 from functools import wraps
+from collections import namedtuple
 
 from multiprocessing.heap import BufferWrapper
 
@@ -21,8 +29,79 @@ def put_on_heap(na):
 
     return (arena.buffer, address)
 
-def RawNumpy(array):
-    mmap, address = put_on_heap(array)
+def place(arr, numa):
+    """
+    Apply a NUMA placement to the memory backing ``arr``, best done
+    before it is first touched ( pages already touched are moved ).
+    ``numa`` is a node number, a policy name ( 'interleave' spreads the
+    pages over every node ) or a ``(policy, nodes)`` pair.
+    """
+    if numa is None:
+        return
+    from numpush.posix_io.numa import mbind
+
+    if isinstance(numa, (int, long)):
+        mbind(arr, 'bind', [numa])
+    elif isinstance(numa, basestring):
+        mbind(arr, numa)
+    else:
+        policy, nodes = numa
+        mbind(arr, policy, nodes)
+
+# Huge Pages
+# ----------
+
+# Huge pages cut the TLB misses on big shared arrays. Anonymous shared
+# memory is first taken from the reserved hugetlb pool ( MAP_HUGETLB ),
+# failing that, and for named segments, we ask for transparent huge
+# pages with madvise. See shmem_stat.huge_pages for what we actually got.
+
+MAP_HUGETLB   = 0x40000
+MADV_HUGEPAGE = 14
+
+_libc = ctypes.CDLL(None, use_errno=True)
+
+def hugepagesize():
+    with open('/proc/meminfo') as f:
+        for line in f:
+            if line.startswith('Hugepagesize:'):
+                return int(line.split()[1]) * 1024
+    return 2 * 1024 * 1024
+
+def madvise_huge(arr):
+    """
+    Ask for transparent huge pages under ``arr``, returns False when
+    the kernel won't do it.
+    """
+    address = arr.__array_interface__['data'][0]
+    start = address // mmap.PAGESIZE * mmap.PAGESIZE
+    stop = address + arr.nbytes
+    ret = _libc.madvise(ctypes.c_void_p(start), ctypes.c_size_t(stop - start),
+            MADV_HUGEPAGE)
+    return ret == 0
+
+def huge_buffer(nbytes):
+    """
+    Anonymous shared mapping of at least ``nbytes`` backed by huge pages
+    where possible.
+    """
+    pagesize = hugepagesize()
+    size = max(nbytes + pagesize - 1, pagesize) // pagesize * pagesize
+    try:
+        return mmap.mmap(-1, size, flags=mmap.MAP_SHARED | MAP_HUGETLB)
+    except EnvironmentError:
+        # No reserved pool ( vm.nr_hugepages ), try THP
+        buf = mmap.mmap(-1, size)
+        madvise_huge(ndarray.__new__(ndarray, (size,), dtype='B', buffer=buf))
+        return buf
+
+def RawNumpy(array, numa=None, huge=False):
+    if huge:
+        mmap = huge_buffer(array.nbytes)
+        address = ndarray.__new__(ndarray, (0,), dtype='B',
+                buffer=mmap).ctypes.data
+    else:
+        mmap, address = put_on_heap(array)
     mmap_nd = ndarray.__new__(
         ndarray,
         array.shape,
@@ -31,6 +110,7 @@ def RawNumpy(array):
         offset=0,
         order='C'
     )
+    place(mmap_nd, numa)
     mmap_nd[:] = array[:]
     assert mmap_nd.ctypes.data == address
     return mmap_nd
@@ -60,6 +140,165 @@ def sync(f):
     return wrapper
 
 
+# Named Shared Memory
+# -------------------
+
+# Arrays backed by a file in /dev/shm ( what shm_open does on Linux )
+# can be attached by name from any process on the host, not just forked
+# children. The segment starts with a small self-describing header:
+#
+#   [ magic ][ data offset ][ header length ][ header ] .. [ data ]
+#
+# The header is the same dict literal as a .npy header ( descr, shape,
+# fortran_order ) and the data starts on a page boundary.
+
+SHM_DIR = '/dev/shm'
+SHM_MAGIC = b'NUMPUSH\x01'
+SHM_PREAMBLE = struct.Struct('<8sQQ')
+
+class SharedArray(ndarray):
+    """
+    ndarray living in a named shared memory segment. Pickling it, or
+    any view of it, only sends the segment name and the view geometry,
+    the receiving process attaches to the same memory.
+    """
+
+    def __array_finalize__(self, obj):
+        self.name = getattr(obj, 'name', None)
+        self._shm_bounds = getattr(obj, '_shm_bounds', None)
+        self._shm_offset = getattr(obj, '_shm_offset', None)
+
+    def __reduce__(self):
+        bounds = self._shm_bounds
+        if bounds is None:
+            return asarray(self).__reduce__()
+
+        lo, hi = byte_bounds(self)
+        # Not a view onto the segment, e.g. the result of arithmetic
+        if lo < bounds[0] or hi > bounds[1]:
+            return asarray(self).__reduce__()
+
+        offset = self._shm_offset + self.ctypes.data - bounds[0]
+        return (_attach_view, (self.name, offset, self.shape, self.strides,
+            self.dtype))
+
+def _shm_path(name):
+    if not name or '/' in name:
+        raise ValueError("Invalid shared memory name %r" % name)
+    return os.path.join(SHM_DIR, name)
+
+def _shm_view(name, mm, data_offset, offset, shape, dtype, strides=None,
+        order='C'):
+    nd = ndarray.__new__(
+        SharedArray,
+        shape,
+        dtype   = dtype,
+        buffer  = mm,
+        offset  = offset,
+        strides = strides,
+        order   = order
+    )
+    start = nd.ctypes.data - offset
+    nd.name = name
+    nd._shm_bounds = (start + data_offset, start + len(mm))
+    nd._shm_offset = data_offset
+    return nd
+
+def _read_header(mm):
+    magic, offset, hlen = SHM_PREAMBLE.unpack_from(mm, 0)
+    if magic != SHM_MAGIC:
+        raise ValueError("Not a numpush shared memory segment")
+    start = SHM_PREAMBLE.size
+    header = safe_eval(mm[start:start + hlen])
+    return offset, header
+
+def _map(name, readonly=False):
+    fd = os.open(_shm_path(name), os.O_RDONLY if readonly else os.O_RDWR)
+    try:
+        size = os.fstat(fd).st_size
+        access = mmap.ACCESS_READ if readonly else mmap.ACCESS_WRITE
+        return mmap.mmap(fd, size, access=access)
+    finally:
+        os.close(fd)
+
+def create(name, shape, dtype, order='C', numa=None, huge=False):
+    """
+    Create a named shared memory array, it lives until ``unlink``.
+    ``numa`` places its pages, see ``place``, ``huge`` asks for
+    transparent huge pages.
+    """
+    dtype = np_dtype(dtype)
+    if isinstance(shape, (int, long)):
+        shape = (shape,)
+    shape = tuple(shape)
+
+    header = repr({
+        'descr'         : dtype_to_descr(dtype),
+        'fortran_order' : order == 'F',
+        'shape'         : shape,
+    })
+    preamble = SHM_PREAMBLE.size + len(header)
+    offset = (preamble + mmap.PAGESIZE - 1) // mmap.PAGESIZE * mmap.PAGESIZE
+
+    nbytes = dtype.itemsize
+    for dim in shape:
+        nbytes *= dim
+
+    # The segment is filled in under a temporary name and then linked
+    # into place so nobody can attach to a half written header.
+    path = _shm_path(name)
+    tmp = '%s.%i.tmp' % (path, os.getpid())
+    fd = os.open(tmp, os.O_RDWR | os.O_CREAT | os.O_EXCL, 0600)
+    try:
+        os.ftruncate(fd, offset + nbytes)
+        mm = mmap.mmap(fd, offset + nbytes)
+        mm[:preamble] = SHM_PREAMBLE.pack(SHM_MAGIC, offset, len(header)) + header
+        os.link(tmp, path)
+    finally:
+        os.close(fd)
+        os.unlink(tmp)
+
+    nd = _shm_view(name, mm, offset, offset, shape, dtype, order=order)
+    place(nd, numa)
+    if huge:
+        madvise_huge(nd)
+    return nd
+
+def attach(name, readonly=False):
+    """
+    Attach to the named shared memory array created by ``create``, from
+    any process on the host. No data is copied.
+    """
+    mm = _map(name, readonly)
+    offset, header = _read_header(mm)
+    order = 'F' if header['fortran_order'] else 'C'
+    return _shm_view(name, mm, offset, offset, header['shape'],
+            np_dtype(header['descr']), order=order)
+
+def _attach_view(name, offset, shape, strides, dtype):
+    mm = _map(name)
+    data_offset, header = _read_header(mm)
+    return _shm_view(name, mm, data_offset, offset, shape, dtype,
+            strides=strides)
+
+def unlink(name):
+    """
+    Remove the name, the memory is freed once every process attached to
+    it has dropped its arrays.
+    """
+    os.unlink(_shm_path(name))
+
+def NamedNumpy(array, name, numa=None, huge=False):
+    """
+    Copy ``array`` into a new named shared memory array.
+    """
+    order = 'F' if array.flags.f_contiguous and not array.flags.c_contiguous \
+            else 'C'
+    snd = create(name, array.shape, array.dtype, order=order, numa=numa,
+            huge=huge)
+    snd[...] = array
+    return snd
+
 # Shared Memory Instances
 # -----------------------
 
@@ -73,6 +312,94 @@ def SDataFrame(df, mutex=False, lock=None):
     columns = df.columns.tolist()  # list
     return DataFrame(data=snd, index=index, columns=columns, dtype=None, copy=False)
 
+# Shared DataFrames
+# -----------------
+
+# A DataFrame is shared as one named segment per dtype block, laid out
+# the way pandas keeps its blocks ( one row per column ), plus a segment
+# for the index. What is left to pickle is a tiny descriptor, from which
+# a child rebuilds the frame directly on the shared blocks.
+
+FrameDescriptor = namedtuple('FrameDescriptor', 'name index columns blocks')
+
+def _shareable(dt):
+    return isinstance(dt, np_dtype) and dt.kind != 'O'
+
+def share_frame(df, name):
+    '''
+    Copy ``df`` into named shared memory and return the descriptor to
+    hand to ``attach_frame`` in any process.
+    '''
+    dtypes = list(df.dtypes)
+    for dt in set(dtypes):
+        if not _shareable(dt):
+            raise TypeError("Can't share columns of dtype %s" % dt)
+
+    # Nothing is left behind in /dev/shm when a segment fails part way
+    created = []
+    try:
+        blocks = []
+        for dt in sorted(set(dtypes), key=str):
+            positions = [i for i, cdt in enumerate(dtypes) if cdt == dt]
+            segment = '%s.block%i' % (name, len(blocks))
+            values = create(segment, (len(positions), len(df.index)), dt)
+            created.append(segment)
+            values[...] = df.take(positions, axis=1).values.T
+            blocks.append((segment, positions))
+
+        # A tz aware DatetimeIndex keeps its values as UTC datetime64
+        index = df.index
+        values = index.values
+        if isinstance(index, MultiIndex) or not _shareable(values.dtype):
+            # Object indexes can't live in shared memory, they are pickled
+            # along with the descriptor
+            index_desc = ('pickled', index)
+        else:
+            segment = '%s.index' % name
+            NamedNumpy(values, segment)
+            created.append(segment)
+            tz = getattr(index, 'tz', None)
+            index_desc = ('shared', segment, index.name, tz and str(tz))
+    except:
+        for segment in created:
+            unlink(segment)
+        raise
+
+    return FrameDescriptor(name, index_desc, df.columns.tolist(), blocks)
+
+def _attach_index(index_desc):
+    if index_desc[0] == 'pickled':
+        return index_desc[1]
+
+    _, segment, name, tz = index_desc
+    values = attach(segment).view(ndarray)
+    if values.dtype.kind == 'M':
+        # The frequency is dropped, validating it would walk the index
+        index = DatetimeIndex(values, name=name)
+        if tz is not None:
+            index = index.tz_localize('UTC').tz_convert(tz)
+        return index
+    return Index(values, name=name, copy=False)
+
+def attach_frame(desc):
+    '''
+    Rebuild the shared DataFrame described by ``desc``, no data is
+    copied.
+    '''
+    index = _attach_index(desc.index)
+    blocks = [
+        make_block(attach(segment).view(ndarray), placement=positions)
+        for segment, positions in desc.blocks
+    ]
+    mgr = BlockManager(blocks, [Index(desc.columns), index])
+    return DataFrame(mgr)
+
+def unlink_frame(desc):
+    for segment, positions in desc.blocks:
+        unlink(segment)
+    if desc.index[0] == 'shared':
+        unlink(desc.index[1])
+
 def STensor(tensor, mutex=False):
     '''
     Shared memory Theano tensor.
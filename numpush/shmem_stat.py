@@ -18,3 +18,44 @@ def shm_counters():
 
         retdict[shmid] = (perms, size, cpid, lpid, nattach, swap)
     return retdict
+
+def huge_pages(arr):
+    """
+    How much of the mapping holding ``arr`` is backed by huge pages,
+    read from /proc/self/smaps. Sizes are in bytes.
+    """
+    address = arr.__array_interface__['data'][0]
+    f = open("/proc/self/smaps", "r")
+    try:
+        lines = f.readlines()
+    finally:
+        f.close()
+
+    fields = None
+    for line in lines:
+        head = line.split(None, 1)[0]
+        if '-' in head and not head.endswith(':'):
+            if fields is not None:
+                break
+            start, stop = [int(x, 16) for x in head.split('-')]
+            if start <= address < stop:
+                fields = {}
+        elif fields is not None:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) * 1024
+
+    if fields is None:
+        raise ValueError("Address %#x is not mapped" % address)
+
+    hugetlb = fields.get('Shared_Hugetlb', 0) + fields.get('Private_Hugetlb', 0)
+    transparent = fields.get('AnonHugePages', 0) + \
+        fields.get('ShmemPmdMapped', 0) + fields.get('FilePmdMapped', 0)
+
+    return {
+        'size'        : fields.get('Size', 0),
+        'pagesize'    : fields.get('KernelPageSize', 0),
+        'hugetlb'     : hugetlb,
+        'transparent' : transparent,
+        'huge'        : bool(hugetlb or transparent),
+    }
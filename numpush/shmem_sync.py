@@ -11,6 +11,9 @@ from multiprocessing.forking import assert_spawning, Popen
 # incremented when the semaphore is released. If the counter reaches zero
 # when acquired, the acquiring thread will block.
 
+# Superseded by numpush.posix_io.rwlock.RWLock, which only makes a
+# syscall when it actually has to sleep.
+
 class SharedExclusiveLock(object):
 
     def __init__(self, maxreaders=120):
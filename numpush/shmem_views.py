@@ -5,10 +5,14 @@ locking transparently against that.
 """
 
 import numpy as np
+from contextlib import contextmanager
 from os import getpid
 import thread
-from threading import currentThread
-from numpush.shmem_sync import SharedExclusiveLock
+from threading import currentThread, local
+from numpush.posix_io.rwlock import StripedLock
+
+# Stripes per SyncNumpy array, each guards an equal share of its bytes
+STRIPES = 64
 
 try:
     from greenlet import getcurrent
@@ -76,15 +80,219 @@ class sview(np.ndarray):
         if have_greenlet:
             self.greenlet = getcurrent()
 
+class _Region(object):
+    """
+    Reentrant guard over stripes ``first`` through ``last`` of a
+    SyncNumpy. A thread already holding a lock that covers the stripes
+    ( in a mode at least as strong ) passes straight through, so the
+    proxy's methods can be called from inside ``with s.reading:`` and
+    the like. Anything else nested inside a held lock raises: writing
+    where it is reading would deadlock on itself, and taking a second
+    range could deadlock against a thread nesting the other way round,
+    stripes are only ordered within a single acquire.
+    """
+
+    __slots__ = ('owner', 'first', 'last', 'write')
+
+    def __init__(self, owner, first, last, write):
+        self.owner = owner
+        self.first = first
+        self.last = last
+        self.write = write
+
+    def __enter__(self):
+        held = self.owner._local.get()
+        holding = False
+        for entry in held:
+            if not entry:
+                continue
+            first, last, write = entry
+            if first <= self.first and self.last <= last and \
+                    (write or not self.write):
+                held.append(None)
+                return
+            holding = True
+
+        if holding:
+            raise RuntimeError("Stripes %i-%i aren't covered by the lock "
+                "this thread holds" % (self.first, self.last))
+
+        self.owner._lock.acquire(self.first, self.last, self.write)
+        held.append((self.first, self.last, self.write))
+
+    def __exit__(self, *args):
+        entry = self.owner._local.get().pop()
+        if entry:
+            self.owner._lock.release(*entry)
+
+class _Held(local):
+    # Stripe ranges each thread holds, innermost last. None marks a
+    # nested guard that passed through.
+
+    def __init__(self):
+        self.pid = getpid()
+        self.held = []
+
+    def get(self):
+        # A forked child inherits the list but none of the locks, it
+        # keeps the depth to unwind the blocks it forked inside of with
+        # every entry marked as not held ( False )
+        if self.pid != getpid():
+            self.pid = getpid()
+            self.held = [False] * len(self.held)
+        return self.held
+
+def _fancy(key):
+    # bool before int, True is an int too
+    return isinstance(key, (list, np.ndarray, bool, np.bool_))
+
+def _fancy_key(key):
+    return _fancy(key) or type(key) is tuple and any(map(_fancy, key))
+
 class SyncNumpy(object):
 
-    def __init__(self, arr):
+    def __init__(self, arr, nstripes=STRIPES):
         self._underlying = arr
 
-        self._lock = SharedExclusiveLock()
+        # Accesses lock only the stripes their byte bounds fall in, so
+        # writers to disjoint regions don't serialize
+        lo, hi = np.byte_bounds(arr)
+        span = max(hi - lo, 1)
+        nstripes = max(1, min(nstripes, span))
+        self._base = lo
+        self._span = span
+        self._stripe = -(-span // nstripes)
+        self._positive = all(stride >= 0 for stride in arr.strides)
+        self._lock = StripedLock(-(-span // self._stripe))
+        self._local = _Held()
+
+        last = self._lock.nstripes - 1
+        self.reading = _Region(self, 0, last, False)
+        self._whole = _Region(self, 0, last, True)
+
+    def writing(self):
+        return self._whole
+
+    def _bounds(self, key):
+        """
+        Byte range of the underlying array touched by ``key``, relative
+        to the start of the array.
+        """
+        arr = self._underlying
+
+        # Fancy indexing could touch anything, don't copy the array
+        # just to find out
+        if _fancy_key(key):
+            return 0, self._span
+
+        # Integer indexing is plain stride arithmetic
+        if isinstance(key, (int, long)):
+            key = (key,)
+        if self._positive and type(key) is tuple and len(key) <= arr.ndim:
+            lo = 0
+            for k, n, stride in zip(key, arr.shape, arr.strides):
+                if not isinstance(k, (int, long)) or not -n <= k < n:
+                    break
+                lo += (k % n) * stride
+            else:
+                hi = lo + arr.itemsize
+                for n, stride in zip(arr.shape[len(key):], arr.strides[len(key):]):
+                    if n == 0:
+                        return lo, lo
+                    hi += (n - 1) * stride
+                return lo, hi
+
+        # Trailing ellipsis turns integer indexing into a 0-d view
+        try:
+            if isinstance(key, tuple):
+                view = arr[key + (Ellipsis,)]
+            else:
+                view = arr[key, ...]
+        except IndexError:
+            view = arr[key]
+
+        # Not a view after all, e.g. a 0-d integer array key
+        if not isinstance(view, np.ndarray) or not np.may_share_memory(view, arr):
+            return 0, self._span
+
+        lo, hi = np.byte_bounds(view)
+        return lo - self._base, hi - self._base
+
+    def region(self, key, write=False):
+        """
+        Guard locking just the stripes covering ``self[key]``.
+        """
+        lo, hi = self._bounds(key)
+        first = lo // self._stripe
+        last = max(hi - 1, lo) // self._stripe
+        return _Region(self, first, min(last, self._lock.nstripes - 1), write)
+
+    # Batch Operations
+    # ================
+
+    # One lock acquisition for a whole batch of element accesses instead
+    # of one per element.
+
+    @contextmanager
+    def batch_write(self, key=Ellipsis):
+        """
+        Hand out the raw array ( or the basic slice ``key`` of it ) for
+        the duration of the block, under a single write lock. Fancy keys
+        would hand out a copy and lose the writes, they are refused.
+        """
+        if _fancy_key(key):
+            raise IndexError("batch_write needs a basic index, use scatter "
+                "for fancy ones")
+        with self.region(key, write=True):
+            yield self._underlying[key]
+
+    @contextmanager
+    def batch_read(self, key=Ellipsis):
+        """
+        As ``batch_write`` but read only, a fancy ``key`` hands out a
+        copy of the selection.
+        """
+        with self.region(key):
+            yield self._underlying[key]
+
+    def _take_region(self, indices, write):
+        # Integer indices only touch the rows between their extremes
+        if isinstance(indices, (list, np.ndarray)):
+            rows = np.asarray(indices)
+            if rows.dtype.kind in 'iu' and rows.size:
+                lo, hi = rows.min(), rows.max()
+                if lo >= 0 and hi < len(self._underlying):
+                    return self.region(slice(lo, hi + 1), write)
+        return self.region(indices, write)
+
+    def scatter(self, indices, values):
+        """
+        ``self[indices] = values`` as one vectorized write.
+        """
+        with self._take_region(indices, True):
+            self._underlying[indices] = values
 
-        self.reading = self._lock
-        self.writing = self._lock.writing
+    def gather(self, indices):
+        """
+        Copy of ``self[indices]`` as one vectorized read.
+        """
+        with self._take_region(indices, False):
+            out = self._underlying[indices]
+            # Basic indexing gives a view, which mustn't escape the lock
+            if isinstance(out, np.ndarray) and \
+                    np.may_share_memory(out, self._underlying):
+                out = out.copy()
+            return out
+
+    def apply_ufunc(self, ufunc, *args, **kwargs):
+        """
+        Apply ``ufunc`` in place over the whole array, e.g.
+        ``apply_ufunc(np.add, 1, where=mask)``.
+        """
+        where = kwargs.pop('where', True)
+        with self.writing():
+            ufunc(self._underlying, *args, out=self._underlying, where=where,
+                    **kwargs)
 
     def data(self):
         raise Exception("Can't access underlying data for SyncNumpy.")
@@ -100,19 +308,19 @@ class SyncNumpy(object):
             return self._underlying
 
     def __getitem__(self, i):
-        with self.reading:
+        with self.region(i):
             return self._underlying[i]
 
     def __setitem__(self, i, value):
-        with self.writing():
+        with self.region(i, write=True):
             self._underlying[i] = value
 
     def __getslice__(self, start, stop):
-        with self.reading:
+        with self.region(slice(start, stop)):
             return self._underlying[start:stop]
 
     def __setslice__(self, start, stop, values):
-        with self.writing():
+        with self.region(slice(start, stop), write=True):
             self._underlying[start:stop] = values
 
     def __contains__(self,ob):
@@ -192,7 +400,7 @@ class SyncNumpy(object):
     for name, op in PyObject_BinaryOperators:
         exec (
             "def __i%(name)s__(self,ob):\n"
-            "    with self.writing:"
+            "    with self.writing():"
             "        return ob %(op)s self._underlying\n"
             "\n"
         )  % locals()
@@ -200,6 +408,6 @@ class SyncNumpy(object):
     for name in PyArray_WriteMethods:
         exec (
             "def %(name)s(self, *args, **kwargs):\n"
-            "    with self.writing:\n"
+            "    with self.writing():\n"
             "        return self._underlying.%(name)s(*args, **kwargs)"
         ) % locals()
@@ -1,20 +1,40 @@
-from libc.stdlib cimport free, malloc
+from libc.stdlib cimport free, malloc, realloc
+from libc.string cimport memcpy
 
 #from cpython.buffer cimport *
 from cpython cimport PyBytes_FromStringAndSize, \
     PyObject_GetBuffer, PyBUF_ANY_CONTIGUOUS, \
-    PyObject_CheckBuffer, PyBuffer_Release
+    PyObject_CheckBuffer, PyBuffer_Release, PyBUF_WRITABLE
+
+from struct import Struct
+from random import getrandbits
+from numpy import empty, uint8, dtype as np_dtype
 
 from zmq.core.error import ZMQError, ZMQBindError
 
 cdef extern from "blosc.h" nogil:
     enum: BLOSC_MAX_OVERHEAD
+    enum: BLOSC_MIN_HEADER_LENGTH
+    enum: BLOSC_MAX_BUFFERSIZE
+    enum: BLOSC_MAX_TYPESIZE
 
     int blosc_compress(int clevel, int doshuffle, size_t typesize, size_t nbytes,
                        void *src, void *dest, size_t destsize)
     int blosc_decompress(void *src, void *dest, size_t destsize)
     void blosc_free_resources()
     int blosc_set_nthreads(int nthreads)
+    void blosc_cbuffer_sizes(void *cbuffer, size_t *nbytes,
+                             size_t *cbytes, size_t *blocksize)
+    void blosc_cbuffer_metainfo(void *cbuffer, size_t *typesize, int *flags)
+    int blosc_getitem(void *src, int start, int nitems, void *dest)
+
+cdef extern from "time.h" nogil:
+    ctypedef long time_t
+    struct timespec:
+        time_t tv_sec
+        long tv_nsec
+    enum: CLOCK_MONOTONIC
+    int clock_gettime(int clk_id, timespec *tp)
 
 ctypedef void zmq_free_fn(void *data, void *hint)
 
@@ -36,6 +56,8 @@ cdef extern from "zmq.h" nogil:
     void *zmq_msg_data (zmq_msg_t *msg)
     size_t zmq_msg_size (zmq_msg_t *msg)
 
+    enum: ZMQ_SNDMORE
+
     int zmq_send (void *s, zmq_msg_t *msg, int flags)
     int zmq_recv (void *s, zmq_msg_t *msg, int flags)
 
@@ -47,93 +69,550 @@ cdef extern from "zmq.h" nogil:
     char *zmq_strerror (int errnum)
     int zmq_errno()
 
-cdef inline object _recv_copy_blosc(void *handle, object msg, int flags=0):
-    cdef zmq_msg_t zmq_msg
-    cdef char *data_c = NULL
-    cdef Py_ssize_t data_len_c
+cdef void _free_blosc(void *data, void *hint) nogil:
+    free(data)
+
+cdef inline double _now() nogil:
+    cdef timespec ts
+    clock_gettime(CLOCK_MONOTONIC, &ts)
+    return ts.tv_sec + ts.tv_nsec * 1e-9
+
+# ==================
+# Compression Policy
+# ==================
+
+# Candidate (clevel, shuffle) settings tried while sampling a stream.
+# A clevel of 0 makes blosc fall back to a plain memcpy behind the
+# header, which is how incompressible payloads skip compression without
+# the receiver having to know about it.
+CANDIDATES = [(0, 0), (1, 0), (1, 1), (5, 0), (5, 1), (9, 1)]
+
+class CompressionPolicy(object):
+    """
+    Chooses the blosc level and shuffle for each stream so as to
+    maximize the effective bandwidth over a link of ``link_speed``
+    bytes per second.
+
+    Each candidate setting is tried once on a stream and its ratio and
+    compression time recorded, the setting with the lowest estimated
+    time per byte ( compression + transfer of the compressed bytes ) is
+    then used for the next ``resample`` messages before sampling again.
+    """
+
+    def __init__(self, link_speed, candidates=CANDIDATES, resample=1000):
+        self.link_speed = float(link_speed)
+        self.candidates = list(candidates)
+        self.resample = resample
+        self.stats = {}
+
+    def _stream(self, stream):
+        st = self.stats.get(stream)
+        if st is None:
+            st = self.stats[stream] = {
+                'clevel'        : None,
+                'shuffle'       : None,
+                'ratio'         : None,
+                'compress_time' : None,
+                'messages'      : 0,
+                'samples'       : {},
+                'pending'       : list(self.candidates),
+            }
+        return st
+
+    def cost(self, nbytes, cbytes, elapsed):
+        # Seconds per uncompressed byte to compress and put on the wire
+        return (elapsed + cbytes / self.link_speed) / nbytes
+
+    def choose(self, stream=None):
+        st = self._stream(stream)
+        if st['pending']:
+            return st['pending'][0]
+        return st['clevel'], st['shuffle']
+
+    def record(self, stream, clevel, shuffle, nbytes, cbytes, elapsed):
+        # Empty messages say nothing about a setting
+        if nbytes == 0:
+            return
+        st = self._stream(stream)
+        setting = (clevel, shuffle)
+
+        st['messages'] += 1
+        st['ratio'] = nbytes / float(cbytes)
+        st['compress_time'] = elapsed
+
+        if setting in st['pending']:
+            st['pending'].remove(setting)
+            st['samples'][setting] = (
+                st['ratio'],
+                elapsed,
+                self.cost(nbytes, cbytes, elapsed),
+            )
+            if not st['pending']:
+                best = min(st['samples'], key=lambda k: st['samples'][k][2])
+                st['clevel'], st['shuffle'] = best
+                st['messages'] = 0
+        elif st['messages'] >= self.resample:
+            st['pending'] = list(self.candidates)
+
+# =========
+# Transfers
+# =========
+
+cdef inline int _recv_msg(void *handle, zmq_msg_t *zmq_msg, int flags) except -1:
+    cdef int rc
 
     with nogil:
-        zmq_msg_init (&zmq_msg)
-        rc = zmq_recv(handle, &zmq_msg, flags)
+        zmq_msg_init(zmq_msg)
+        rc = zmq_recv(handle, zmq_msg, flags)
 
     if rc < 0:
+        zmq_msg_close(zmq_msg)
         raise ZMQError()
 
-    with nogil:
-        data_len_c = zmq_msg_size(&zmq_msg)
-        blosc_decompress(zmq_msg_data(&zmq_msg), <void*>data_c,
-                data_len_c-BLOSC_MAX_OVERHEAD)
-        zmq_msg_close(&zmq_msg)
+    if zmq_msg_size(zmq_msg) < BLOSC_MIN_HEADER_LENGTH:
+        zmq_msg_close(zmq_msg)
+        raise ValueError("Message is not a blosc buffer")
+    return 0
 
-    zmq_msg_close(&zmq_msg)
-    return PyBytes_FromStringAndSize(data_c, data_len_c)
+cdef inline Py_ssize_t _decompress_msg(zmq_msg_t *zmq_msg, char *dest,
+        size_t destsize) except -1:
+    """Decompress a received block into ``dest`` and close the message."""
+    cdef size_t nbytes, cbytes, blocksize
+    cdef int dbytes
 
-cdef inline object _send_copy_blosc(void *handle, object msg, int flags=0):
-    """Send a message on this socket by copying its content."""
-    cdef int rc, rc2
-    cdef zmq_msg_t data
-    cdef char *msg_c
-    cdef Py_ssize_t msg_c_len=0
+    blosc_cbuffer_sizes(zmq_msg_data(zmq_msg), &nbytes, &cbytes, &blocksize)
 
-    # -- blosc stuff
-    cdef size_t nbytes, cbytes, typesize, size
-    cdef int clevel = 8
-    cdef int doshuffle = 1
+    if nbytes > destsize:
+        zmq_msg_close(zmq_msg)
+        raise ValueError("Output buffer too small, need %i bytes" % nbytes)
 
-    # -- memoryview
-    cdef int mode
-    cdef Py_buffer view
-    cdef void *view_ptr = NULL
+    # An empty buffer compresses to a bare header, nothing to decompress
+    if nbytes == 0:
+        zmq_msg_close(zmq_msg)
+        return 0
 
-    if not PyObject_CheckBuffer(msg):
-        raise TypeError("%r does not provide a buffer interface." % msg)
+    with nogil:
+        dbytes = blosc_decompress(zmq_msg_data(zmq_msg), dest, destsize)
+        zmq_msg_close(zmq_msg)
+
+    if dbytes <= 0 or <size_t>dbytes != nbytes:
+        raise RuntimeError("Blosc decompression failed: rc = %i" % dbytes)
+    return nbytes
+
+cdef inline object _prepare_out(object out, object dtype, size_t nbytes,
+        Py_buffer *view):
+    if out is None:
+        out = empty(nbytes, dtype=uint8)
+        if dtype is not None:
+            out = out.view(dtype)
+    PyObject_GetBuffer(out, view, PyBUF_ANY_CONTIGUOUS|PyBUF_WRITABLE)
+    return out
+
+cdef inline object _recv_blosc(void *handle, object out, object dtype,
+        int flags=0):
+    """Receive a compressed message and decompress it into a numpy
+    array, either the preallocated ``out`` or a fresh one."""
+    cdef zmq_msg_t zmq_msg
+    cdef size_t nbytes, cbytes, blocksize
+    cdef Py_buffer view
 
-    flags = PyBUF_ANY_CONTIGUOUS
-    PyObject_GetBuffer(msg, &view, flags)
+    _recv_msg(handle, &zmq_msg, flags)
+    blosc_cbuffer_sizes(zmq_msg_data(&zmq_msg), &nbytes, &cbytes, &blocksize)
 
-    #msg_c = malloc(view.len+BLOSC_MAX_OVERHEAD)
-    msg_c = <char*>&view_ptr
-    msg_c_len = < Py_ssize_t>view.len
+    try:
+        out = _prepare_out(out, dtype, nbytes, &view)
+    except:
+        zmq_msg_close(&zmq_msg)
+        raise
+
+    try:
+        _decompress_msg(&zmq_msg, <char*>view.buf, view.len)
+    finally:
+        PyBuffer_Release(&view)
+    return out
+
+cdef inline int _send_block(void *handle, char *src, size_t nbytes,
+        size_t typesize, int clevel, int doshuffle, int flags, int copy,
+        double *elapsed) except -1:
+    """Compress ``nbytes`` at ``src`` and send them as one message.
+
+    With copy=False the compressed block is handed over to zmq with
+    zmq_msg_init_data and freed once zmq is done with it, otherwise it
+    is copied into a zmq owned message. Returns the compressed size.
+    """
+    cdef int rc, rc2
+    cdef int cbytes
+    cdef zmq_msg_t data
+    cdef char *dest = NULL
+    cdef char *shrunk
+    cdef double start
 
-    # blosc typesize <- memoryview itemsize
-    typesize = view.itemsize
-    PyBuffer_Release(&view)
+    dest = <char*>malloc(nbytes + BLOSC_MAX_OVERHEAD)
+    if dest == NULL:
+        raise MemoryError()
 
     with nogil:
-        rc = zmq_msg_init_size(&data, msg_c_len)
-        size = zmq_msg_size(&data)
-
+        start = _now()
         cbytes = blosc_compress(
             clevel,
             doshuffle,
             typesize,
-            size,
-            msg_c,
-            zmq_msg_data(&data),
-            (size+BLOSC_MAX_OVERHEAD)
+            nbytes,
+            src,
+            dest,
+            nbytes + BLOSC_MAX_OVERHEAD
         )
+        elapsed[0] = _now() - start
+
+    if cbytes <= 0:
+        free(dest)
+        raise RuntimeError("Blosc compression failed: rc = %i" % cbytes)
+
+    if copy:
+        rc = zmq_msg_init_size(&data, cbytes)
+        if rc == 0:
+            memcpy(zmq_msg_data(&data), dest, cbytes)
+        free(dest)
+    else:
+        # Truncate to the compressed size, zmq now owns the block
+        shrunk = <char*>realloc(dest, cbytes)
+        if shrunk != NULL:
+            dest = shrunk
+        rc = zmq_msg_init_data(&data, dest, cbytes, _free_blosc, NULL)
+        if rc != 0:
+            free(dest)
 
     if rc != 0:
-        raise RuntimeError()
+        raise ZMQError()
+
+    with nogil:
+        rc = zmq_send(handle, &data, flags)
+        rc2 = zmq_msg_close(&data)
+
+    if rc < 0 or rc2 != 0:
+        raise ZMQError()
+    return cbytes
+
+cdef inline int _get_send_buffer(object msg, Py_buffer *view,
+        size_t *typesize) except -1:
+    if not PyObject_CheckBuffer(msg):
+        raise TypeError("%r does not provide a buffer interface." % msg)
+
+    PyObject_GetBuffer(msg, view, PyBUF_ANY_CONTIGUOUS)
+
+    # blosc typesize <- memoryview itemsize, shuffle is only useful on
+    # items blosc knows how to handle
+    typesize[0] = view.itemsize
+    if typesize[0] < 1 or typesize[0] > BLOSC_MAX_TYPESIZE:
+        typesize[0] = 1
+    return 0
+
+cdef inline object _send_blosc(void *handle, object msg, int clevel,
+        int doshuffle, int flags=0, int copy=True):
+    """Compress a buffer and send it on this socket. The compressor
+    reads straight from the buffer of ``msg``."""
+    cdef Py_buffer view
+    cdef size_t nbytes, typesize
+    cdef int cbytes
+    cdef double elapsed = 0
+
+    _get_send_buffer(msg, &view, &typesize)
+
+    try:
+        nbytes = view.len
+        if nbytes > BLOSC_MAX_BUFFERSIZE:
+            raise ValueError("Buffer too large for blosc: %i bytes" % nbytes)
+        cbytes = _send_block(handle, <char*>view.buf, nbytes, typesize,
+                clevel, doshuffle, flags, copy, &elapsed)
+    finally:
+        PyBuffer_Release(&view)
+
+    return nbytes, cbytes, elapsed
+
+# Chunked Transfers
+# -----------------
+
+# Large arrays are split into fixed size blocks, each compressed and
+# sent as its own message behind a small header:
+#
+#   [ id, nbytes, blocksize, nblocks ] [ id, 0 | block 0 ] ...
+#
+# zmq_send only queues the block for the io thread, so block k is on the
+# wire while block k+1 is being compressed, and the receiver decompresses
+# each block into its final place as it arrives. The blocks are separate
+# messages ( multipart messages are only delivered once complete ), which
+# other sockets' patterns may split up: PUSH and DEALER round-robin them
+# over peers and PUB drops them past the high-water mark. Every block
+# carries the transfer's random id and its sequence number in a frame of
+# its own, so a receiver handed pieces of different transfers raises
+# instead of stitching them together.
+
+DEFAULT_BLOCKSIZE = 4*1024*1024
+CHUNK_HEADER = Struct('!QQQQ')
+CHUNK_TAG = Struct('!QQ')
+
+class ChunkedTransferError(RuntimeError):
+    pass
+
+cdef inline int _send_frame(void *handle, bytes frame, int flags) except -1:
+    cdef int rc, rc2
+    cdef zmq_msg_t data
+    cdef char *frame_c = frame
 
-    print "Typesize", typesize
-    print 'Compression ratio', ((size-cbytes*1.0)/(size))
+    rc = zmq_msg_init_size(&data, len(frame))
+    if rc != 0:
+        raise ZMQError()
+    memcpy(zmq_msg_data(&data), frame_c, len(frame))
 
     with nogil:
         rc = zmq_send(handle, &data, flags)
         rc2 = zmq_msg_close(&data)
-        #free(output)
 
     if rc < 0 or rc2 != 0:
         raise ZMQError()
+    return 0
+
+cdef inline bytes _recv_frame(void *handle, int flags):
+    cdef int rc
+    cdef zmq_msg_t zmq_msg
+
+    with nogil:
+        zmq_msg_init(&zmq_msg)
+        rc = zmq_recv(handle, &zmq_msg, flags)
+
+    if rc < 0:
+        zmq_msg_close(&zmq_msg)
+        raise ZMQError()
+
+    frame = PyBytes_FromStringAndSize(<char*>zmq_msg_data(&zmq_msg),
+            zmq_msg_size(&zmq_msg))
+    zmq_msg_close(&zmq_msg)
+    return frame
+
+cdef inline void _drain(void *handle, size_t n, int flags):
+    # Blocks are two part messages, tag and data
+    cdef zmq_msg_t zmq_msg
+    cdef size_t i
+
+    with nogil:
+        for i in range(2 * n):
+            zmq_msg_init(&zmq_msg)
+            zmq_recv(handle, &zmq_msg, flags)
+            zmq_msg_close(&zmq_msg)
+
+cdef inline object _send_chunked_blosc(void *handle, object msg,
+        size_t blocksize, int clevel, int doshuffle, int flags=0):
+    cdef Py_buffer view
+    cdef size_t nbytes, typesize, nblocks, offset, k
+    cdef size_t cbytes = 0
+    cdef double elapsed, total = 0
+
+    _get_send_buffer(msg, &view, &typesize)
+    transfer = getrandbits(64)
+
+    try:
+        nbytes = view.len
+
+        # Blocks must not split items or the shuffle is wasted
+        blocksize -= blocksize % typesize
+        if blocksize == 0:
+            blocksize = typesize
+        if blocksize > BLOSC_MAX_BUFFERSIZE:
+            raise ValueError("Block too large for blosc: %i bytes" % blocksize)
+        nblocks = (nbytes + blocksize - 1) // blocksize
+
+        _send_frame(handle, CHUNK_HEADER.pack(transfer, nbytes, blocksize,
+                nblocks), flags)
+
+        for k in range(nblocks):
+            offset = k * blocksize
+            _send_frame(handle, CHUNK_TAG.pack(transfer, k),
+                    flags|ZMQ_SNDMORE)
+            cbytes += _send_block(handle, <char*>view.buf + offset,
+                    min(blocksize, nbytes - offset), typesize, clevel,
+                    doshuffle, flags, False, &elapsed)
+            total += elapsed
+    finally:
+        PyBuffer_Release(&view)
+
+    return nbytes, cbytes, total
+
+cdef inline object _recv_chunked_blosc(void *handle, object out,
+        object dtype, int flags=0):
+    cdef zmq_msg_t zmq_msg
+    cdef size_t nbytes, blocksize, nblocks, offset, k
+    cdef Py_buffer view
+
+    header = _recv_frame(handle, flags)
+    if len(header) != CHUNK_HEADER.size:
+        raise ChunkedTransferError("Not the start of a chunked transfer")
+    transfer, nbytes, blocksize, nblocks = CHUNK_HEADER.unpack(header)
+
+    # The remaining blocks are drained after a failure so that the
+    # socket is left at the start of the next transfer
+    k = 0
+    try:
+        out = _prepare_out(out, dtype, nbytes, &view)
+    except:
+        _drain(handle, nblocks, flags)
+        raise
+
+    try:
+        if <size_t>view.len < nbytes:
+            raise ValueError("Output buffer too small, need %i bytes" % nbytes)
+
+        offset = 0
+        while k < nblocks:
+            seq = k
+            tag = _recv_frame(handle, flags)
+            if len(tag) != CHUNK_TAG.size:
+                # Not a block at all, whatever follows isn't ours to drain
+                k = nblocks
+                raise ChunkedTransferError("Block %i of transfer %x is "
+                        "missing" % (seq, transfer))
+
+            k += 1
+            _recv_msg(handle, &zmq_msg, flags)
+            if CHUNK_TAG.unpack(tag) != (transfer, seq):
+                zmq_msg_close(&zmq_msg)
+                k = nblocks
+                raise ChunkedTransferError("Block %i of transfer %x is "
+                        "missing or out of order" % (seq, transfer))
+            offset += _decompress_msg(&zmq_msg, <char*>view.buf + offset,
+                    nbytes - offset)
+    except:
+        _drain(handle, nblocks - k, flags)
+        raise
+    finally:
+        PyBuffer_Release(&view)
+
+    if offset != nbytes:
+        raise RuntimeError("Chunked transfer incomplete: %i of %i bytes"
+                % (offset, nbytes))
+    return out
+
+# Compressed Arrays
+# -----------------
+
+cdef class CompressedArray:
+    """
+    A received blosc buffer kept in compressed form, indexing it with an
+    integer or a slice decompresses only the blosc blocks covering the
+    requested range using blosc_getitem.
+    """
+
+    cdef zmq_msg_t msg
+    cdef bint live
+    cdef readonly object dtype
+    cdef readonly size_t nbytes
+    cdef readonly size_t cbytes
+    cdef readonly size_t typesize
+    cdef Py_ssize_t length
+    cdef int scale
+
+    def __dealloc__(self):
+        if self.live:
+            zmq_msg_close(&self.msg)
+
+    cdef int _init(self, object dtype) except -1:
+        cdef size_t blocksize
+        cdef int flags
+
+        blosc_cbuffer_sizes(zmq_msg_data(&self.msg), &self.nbytes,
+                &self.cbytes, &blocksize)
+        blosc_cbuffer_metainfo(zmq_msg_data(&self.msg), &self.typesize,
+                &flags)
+
+        self.dtype = np_dtype(dtype)
+        itemsize = self.dtype.itemsize
+
+        # blosc_getitem counts in units of the typesize the buffer was
+        # compressed with
+        if itemsize % self.typesize or self.nbytes % itemsize:
+            raise ValueError("dtype %s does not match a typesize %i buffer"
+                    % (self.dtype, self.typesize))
+
+        self.scale = itemsize // self.typesize
+        self.length = self.nbytes // itemsize
+        return 0
+
+    def __len__(self):
+        return self.length
+
+    @property
+    def shape(self):
+        return (self.length,)
+
+    @property
+    def ratio(self):
+        return self.nbytes / float(self.cbytes)
+
+    cdef object _range(self, Py_ssize_t start, Py_ssize_t stop):
+        cdef int rc
+        cdef Py_buffer view
+
+        out = empty(max(stop - start, 0), dtype=self.dtype)
+        if stop <= start:
+            return out
+
+        PyObject_GetBuffer(out, &view, PyBUF_ANY_CONTIGUOUS|PyBUF_WRITABLE)
+        with nogil:
+            rc = blosc_getitem(zmq_msg_data(&self.msg), start * self.scale,
+                    (stop - start) * self.scale, view.buf)
+        PyBuffer_Release(&view)
+
+        if rc < 0:
+            raise RuntimeError("Blosc getitem failed: rc = %i" % rc)
+        return out
+
+    def __getitem__(self, key):
+        cdef Py_ssize_t start, stop, step, n, last
+
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.length)
+            n = len(xrange(start, stop, step))
+            if n == 0 or step == 1:
+                return self._range(start, start + n)
+
+            # Decompress the covering range, then stride over it
+            last = start + (n - 1) * step
+            lo, hi = min(start, last), max(start, last) + 1
+            return self._range(lo, hi)[start - lo::step][:n]
+
+        start = key
+        if start < 0:
+            start += self.length
+        if not 0 <= start < self.length:
+            raise IndexError("index out of range")
+        return self._range(start, start + 1)[0]
+
+    def decompress(self):
+        """Decompress the whole buffer into a new array."""
+        return self._range(0, self.length)
+
+    def __array__(self):
+        return self.decompress()
+
+    def __repr__(self):
+        return "<CompressedArray(%s, %i, ratio=%.2f)>" % (
+                self.dtype, self.length, self.ratio)
 
 cdef class BloscSocket:
 
     cdef void *handle
     cdef void *ctx
-
-    def __init__(self, context, int socket_type):
-        pass
+    cdef public int clevel
+    cdef public int shuffle
+    cdef public object policy
+    cdef public dict stats
+
+    def __init__(self, context, int socket_type, link_speed=None):
+        self.clevel = 8
+        self.shuffle = 1
+        self.stats = {}
+        if link_speed is not None:
+            self.policy = CompressionPolicy(link_speed)
+            self.stats = self.policy.stats
 
     def __cinit__(self, BloscContext context, int socket_type, *args, **kwrags):
         cdef Py_ssize_t c_handle = context._handle
@@ -159,17 +638,69 @@ cdef class BloscSocket:
         if rc != 0:
             raise ZMQError()
 
-    cpdef object send(self, object data, int flags=0, copy=True, track=False):
-        if copy:
-            return _send_copy_blosc(self.handle, data, flags)
-        else:
-            raise NotImplementedError
-
-    cpdef object recv(self, int flags=0, copy=True, track=False):
-        if copy:
-            return _recv_copy_blosc(self.handle, flags)
+    # Compression statistics are kept per ``stream`` in ``self.stats``,
+    # with a policy set the stream's clevel and shuffle are chosen by it.
+    cpdef object send(self, object data, int flags=0, copy=True, track=False,
+            stream=None):
+        cdef int clevel = self.clevel
+        cdef int shuffle = self.shuffle
+
+        if self.policy is not None:
+            clevel, shuffle = self.policy.choose(stream)
+
+        nbytes, cbytes, elapsed = _send_blosc(self.handle, data, clevel,
+                shuffle, flags, copy)
+        self._record(stream, clevel, shuffle, nbytes, cbytes, elapsed)
+
+    # Decompression always lands in a fresh (or the given ``out``)
+    # array, the compressed message itself is never copied out of zmq,
+    # so copy=True and copy=False behave the same.
+    cpdef object recv(self, int flags=0, copy=True, track=False,
+            dtype=None, out=None):
+        return _recv_blosc(self.handle, out, dtype, flags)
+
+    def recv_compressed(self, int flags=0, dtype=uint8):
+        """Receive a message without decompressing it, slices of the
+        returned CompressedArray are decompressed on demand."""
+        cdef CompressedArray ca = CompressedArray.__new__(CompressedArray)
+        _recv_msg(self.handle, &ca.msg, flags)
+        ca.live = True
+        ca._init(dtype)
+        return ca
+
+    def _record(self, stream, clevel, shuffle, nbytes, cbytes, elapsed):
+        if self.policy is not None:
+            self.policy.record(stream, clevel, shuffle, nbytes, cbytes,
+                    elapsed)
         else:
-            raise NotImplementedError
+            self.stats[stream] = {
+                'clevel'        : clevel,
+                'shuffle'       : shuffle,
+                'ratio'         : nbytes / float(cbytes),
+                'compress_time' : elapsed,
+            }
+
+    def send_chunked(self, object data, size_t blocksize=DEFAULT_BLOCKSIZE,
+            int flags=0, stream=None):
+        """Send a large buffer as a pipelined stream of compressed
+        blocks, to be received with ``recv_chunked``. The blocks are
+        separate messages, on sockets that round-robin or drop messages
+        ( PUSH or DEALER with several peers, PUB ) a receiver may get
+        only part of a transfer and raises ChunkedTransferError."""
+        cdef int clevel = self.clevel
+        cdef int shuffle = self.shuffle
+
+        if self.policy is not None:
+            clevel, shuffle = self.policy.choose(stream)
+
+        nbytes, cbytes, elapsed = _send_chunked_blosc(self.handle, data,
+                blocksize, clevel, shuffle, flags)
+        self._record(stream, clevel, shuffle, nbytes, cbytes, elapsed)
+
+    def recv_chunked(self, int flags=0, dtype=None, out=None):
+        """Receive a ``send_chunked`` stream, decompressing each block
+        into the preallocated array as it arrives."""
+        return _recv_chunked_blosc(self.handle, out, dtype, flags)
 
 cdef class BloscContext:
 
@@ -191,8 +722,8 @@ cdef class BloscContext:
     def _handle(self):
         return <Py_ssize_t> self.handle
 
-    def socket(self, int socket_type):
-        return BloscSocket(self, socket_type)
+    def socket(self, int socket_type, link_speed=None):
+        return BloscSocket(self, socket_type, link_speed)
 
     def __dealloc__(self):
         blosc_free_resources()
@@ -201,4 +732,5 @@ cdef class BloscContext:
 
 Context = BloscContext
 Socket  = BloscSocket
-__all__ = [ Context, Socket ]
+__all__ = [ Context, Socket, CompressionPolicy, CompressedArray,
+            ChunkedTransferError ]
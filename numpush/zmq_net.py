@@ -58,15 +58,35 @@ PANDASTS = b'\x00\x05'
 NETWORKX = b'\x00\x06'
 THEANO   = b'\x00\x07'
 
+# A batch carries the metadata for N objects in a single header frame
+# followed by N payload frames.
+BATCH    = b'\x00\x08'
+
+# Arrays described by the binary wire header ( see reductor ), any
+# dtype and memory layout, no msgpack involved.
+NUMPYHDR = b'\x00\x09'
+
 PYTHONBYTECODE  = b'\x01\x01'
 
 type_coercions = {
-    array     : NUMPYND,
-    ndarray   : NUMPYND,
+    array     : NUMPYHDR,
+    ndarray   : NUMPYHDR,
     DataFrame : PANDAS,
     Tensor    : THEANO,
 }
 
+reducers = {
+    NUMPYND  : reductor.numpy_reduce,
+    NUMPYHDR : reductor.numpy_header_reduce,
+    PANDAS   : reductor.pandas_reduce,
+}
+
+reconstructors = {
+    NUMPYND  : reductor.numpy_reconstruct,
+    NUMPYHDR : reductor.numpy_header_reconstruct,
+    PANDAS   : reductor.pandas_reconstruct,
+}
+
 class CannotCoerce(Exception):
     def __init__(self, obj):
         self.unknown_type = type(obj)
@@ -84,12 +104,27 @@ def send_numpy(self, magic, obj, flags=0):
     self.send(srl.dumps(numpy_metadata), flags|zmq.SNDMORE)
     return self.send(narray, flags, copy=False, track=False)
 
+# With copy=False the payload is received as a zmq.Frame and the array
+# is built directly on the frame buffer, no userspace copy is made.
 def recv_numpy(self, flags=0, copy=True, track=False):
     mdload = srl.loads(self.recv(flags=flags))
     md = numpy_metadata(*mdload)
-    nd = self.recv(flags=flags)
+    nd = self.recv(flags=flags, copy=copy, track=track)
     return reductor.numpy_reconstruct(md, nd)
 
+# Strided arrays may be split over several payload frames, one per
+# contiguous run, see reductor.numpy_header_reduce.
+def send_array(self, magic, obj, flags=0):
+    header, frames = reductor.numpy_header_reduce(obj)
+    self.send(magic, flags|zmq.SNDMORE)
+    self.send(header, flags|zmq.SNDMORE)
+    return self.send_multipart(frames, flags, copy=False, track=False)
+
+def recv_array(self, flags=0, copy=True, track=False):
+    header = self.recv(flags=flags)
+    frames = self.recv_multipart(flags=flags, copy=copy, track=track)
+    return reductor.numpy_header_reconstruct(header, frames)
+
 def send_pandas(self, magic, obj, flags=0):
     pandas_metadata, narray = reductor.pandas_reduce(obj)
     self.send(magic, flags|zmq.SNDMORE)
@@ -99,8 +134,8 @@ def send_pandas(self, magic, obj, flags=0):
 def recv_pandas(self, flags=0, copy=True, track=False):
     mdload = srl.loads(self.recv(flags=flags))
     md = pandas_metadata(*mdload)
-    nd = self.recv(flags=flags)
-    return reductor.pandasts_reconstruct(md, nd)
+    nd = self.recv(flags=flags, copy=copy, track=track)
+    return reductor.pandas_reconstruct(md, nd)
 
 def send_tensor(self, magic, obj, flags=0):
     tensor_metadata, narray = reductor.tensor_reduce(obj)
@@ -121,7 +156,9 @@ def recv_tensor(self, flags=0, copy=True, track=False):
 # Polymorphic ZMQ socket mixins for all supported scientific types
 def numsend(self, obj, **kwargs):
     magic = type_coercions.get(type(obj))
-    if magic ==  NUMPYND:
+    if magic == NUMPYHDR:
+        send_array(self, magic, obj, **kwargs)
+    elif magic == NUMPYND:
         send_numpy(self, magic, obj, **kwargs)
     elif magic == PANDAS:
         send_pandas(self, magic, obj, **kwargs)
@@ -130,9 +167,305 @@ def numsend(self, obj, **kwargs):
 
 def numrecv(self, **kwargs):
     magic = self.recv()
-    if magic in [NUMPYND, NUMPY1D, NUMPY2D]:
+    if magic == NUMPYHDR:
+        return recv_array(self, **kwargs)
+    elif magic in [NUMPYND, NUMPY1D, NUMPY2D]:
         return recv_numpy(self, **kwargs)
     elif magic == PANDAS:
         return recv_pandas(self, **kwargs)
     else:
         raise Exception("Unknown wire protocol")
+
+# Batched Transfers
+# =================
+
+# Sending many small arrays one at a time is dominated by per-message
+# overhead, so a batch packs the metadata for every object into one
+# header frame ( one srl.dumps call ) and follows it with the raw
+# payloads as zero-copy frames of the same multipart message. Arrays
+# carry their binary wire header as metadata and may take several
+# payload frames ( see reductor.numpy_header_reduce ), so each entry
+# records how many frames are its own.
+#
+#   [ BATCH ] [ (magic, md, nframes), ... ] [ nd ] [ nd ] ...
+
+def numsend_many(self, objs, flags=0):
+    header = []
+    payloads = []
+
+    for obj in objs:
+        magic = type_coercions.get(type(obj))
+        reduce = reducers.get(magic)
+        if reduce is None:
+            raise CannotCoerce(obj)
+        md, nd = reduce(obj)
+        frames = nd if isinstance(nd, list) else [nd]
+        header.append((magic, md, len(frames)))
+        payloads.extend(frames)
+
+    self.send(BATCH, flags|zmq.SNDMORE)
+    if not payloads:
+        return self.send(srl.dumps(header), flags)
+    self.send(srl.dumps(header), flags|zmq.SNDMORE)
+    return self.send_multipart(payloads, flags, copy=False, track=False)
+
+def numrecv_many(self, flags=0, copy=True, track=False):
+    magic = self.recv(flags=flags)
+    if magic != BATCH:
+        raise Exception("Unknown wire protocol")
+
+    header = srl.loads(self.recv(flags=flags))
+
+    objs = []
+    for magic, md, nframes in header:
+        frames = [self.recv(flags=flags, copy=copy, track=track)
+                  for i in range(nframes)]
+        nd = frames[0] if nframes == 1 else frames
+        objs.append(reconstructors[magic](md, nd))
+    return objs
+
+# Delta Sync
+# ==========
+
+# For arrays pushed over and over with only a few rows changing in
+# between. The sender keeps the last version sent under each stream key
+# and only sends the blocks that changed since, coalesced into runs of
+# consecutive blocks, one frame per run. Subscribers apply them in place.
+#
+#   [ DELTA ] [ key ] [ version, base version, blocksize, flags ]
+#   [ wire header ] [ runs, (first block, nblocks) uint32 pairs ]
+#   [ run ] [ run ] ...
+#
+# Base version 0 is a full snapshot. With DELTA_XOR the runs carry the
+# XOR of the new and old bytes instead, mostly zeros, which is what the
+# Blosc codec compresses best.
+
+DELTA = b'\x00\x0a'
+
+DELTA_HEADER = struct.Struct('<QQQI')
+DELTA_BLOCK  = 64 * 1024
+DELTA_XOR    = 0x01
+
+class DeltaMismatch(Exception):
+    def __init__(self, key, base, have):
+        self.key = key
+        self.base = base
+        self.have = have
+
+    def __str__(self):
+        return "Delta for %r is against version %i, have %s" % (
+            self.key, self.base, self.have)
+
+def _changed_runs(new, old, blocksize):
+    nblocks = -(-len(new) // blocksize)
+    nfull = len(new) // blocksize
+    changed = np.zeros(nblocks, dtype=bool)
+
+    full = nfull * blocksize
+    if nfull:
+        changed[:nfull] = (new[:full].reshape(nfull, blocksize) !=
+                           old[:full].reshape(nfull, blocksize)).any(axis=1)
+    if nblocks > nfull:
+        changed[-1] = (new[full:] != old[full:]).any()
+
+    # Coalesce consecutive changed blocks into (first, count) runs
+    edges = np.diff(np.concatenate(([0], changed.view(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    stops = np.flatnonzero(edges == -1)
+    return np.column_stack((starts, stops - starts))
+
+class DeltaSender(object):
+    """
+    Send successive versions of arrays under stream keys, only the
+    blocks that changed since the last version go on the wire. Every
+    ``snapshot_every`` versions a full snapshot is sent so subscribers
+    that missed a delta can resync.
+    """
+
+    def __init__(self, socket, blocksize=DELTA_BLOCK, xor=False,
+            snapshot_every=None):
+        self.socket = socket
+        self.blocksize = blocksize
+        self.xor = xor
+        self.snapshot_every = snapshot_every
+        # key -> (version, wire header, copy of the bytes last sent)
+        self.last = {}
+
+    def send(self, key, obj, flags=0):
+        obj = np.ascontiguousarray(obj)
+        header, frames = reductor.numpy_header_reduce(obj)
+        new, = frames
+        bs = self.blocksize
+
+        version, last_header, old = self.last.get(key, (0, None, None))
+        snapshot = old is None or last_header != header or (
+            self.snapshot_every and version % self.snapshot_every == 0)
+
+        # The frames go out zero-copy, so they must be neither the
+        # caller's array, which may change before libzmq is done with
+        # it, nor our baseline, which the next delta updates in place
+        dflags = 0
+        if snapshot:
+            base = 0
+            old = new.copy()
+            runs = np.array([[0, -(-len(new) // bs)]]) if len(new) else \
+                np.zeros((0, 2), dtype=int)
+            payloads = [old.copy()] if len(old) else []
+        else:
+            base = version
+            runs = _changed_runs(new, old, bs)
+            payloads = []
+            for first, count in runs:
+                lo, hi = first * bs, (first + count) * bs
+                if self.xor:
+                    payloads.append(new[lo:hi] ^ old[lo:hi])
+                    dflags = DELTA_XOR
+                    old[lo:hi] = new[lo:hi]
+                else:
+                    old[lo:hi] = new[lo:hi]
+                    payloads.append(old[lo:hi].copy())
+
+        version += 1
+        self.last[key] = (version, header, old)
+
+        parts = [DELTA, key, DELTA_HEADER.pack(version, base, bs, dflags),
+                 header, runs.astype('<u4').tostring()]
+        self.socket.send_multipart(parts + payloads, flags, copy=False)
+        return version
+
+class DeltaReceiver(object):
+    """
+    Receive the streams of a DeltaSender, each key's array is updated
+    in place and handed back along with its key.
+    """
+
+    def __init__(self, socket):
+        self.socket = socket
+        # key -> (version, array)
+        self.arrays = {}
+
+    def recv(self, flags=0):
+        parts = self.socket.recv_multipart(flags, copy=False)
+        magic, key, dheader, header, runs = [p.bytes for p in parts[:5]]
+        if magic != DELTA:
+            raise Exception("Unknown wire protocol")
+        payloads = parts[5:]
+
+        version, base, bs, dflags = DELTA_HEADER.unpack(dheader)
+        runs = np.frombuffer(runs, dtype='<u4').reshape(-1, 2)
+
+        if base == 0:
+            _, _, shape, strides, dt, nbytes, _ = \
+                reductor.numpy_header_decode(header)
+            arr = np.empty(shape, dtype=dt)
+        else:
+            have, arr = self.arrays.get(key, (None, None))
+            if have != base:
+                raise DeltaMismatch(key, base, have)
+
+        data = arr.reshape(-1).view('B')
+        for (first, count), payload in zip(runs, payloads):
+            chunk = np.frombuffer(payload, dtype='B')
+            lo = first * bs
+            if dflags & DELTA_XOR:
+                data[lo:lo + len(chunk)] ^= chunk
+            else:
+                data[lo:lo + len(chunk)] = chunk
+
+        self.arrays[key] = (version, arr)
+        return key, arr
+
+# Fan-out
+# =======
+
+# Publishing one object to many topics encodes it once into zmq.Frames,
+# every topic then reuses the same frames ( libzmq only bumps a refcount
+# per send ). The topic goes out as the first frame so SUB sockets drop
+# unwanted topics by prefix inside libzmq, before anything is decoded.
+#
+#   [ topic ] [ magic ] [ header ] [ payload ] ...
+
+class Encoded(list):
+    """
+    The frames of an encoded object, ready to publish any number of
+    times.
+    """
+
+def numencode(obj):
+    magic = type_coercions.get(type(obj))
+    if magic == NUMPYHDR:
+        header, payloads = reductor.numpy_header_reduce(obj)
+    elif magic == PANDAS:
+        md, payload = reductor.pandas_reduce(obj)
+        header, payloads = srl.dumps(md), [payload]
+    else:
+        raise CannotCoerce(obj)
+    return Encoded(zmq.Frame(part) for part in [magic, header] + payloads)
+
+def numpublish(self, topics, obj, flags=0):
+    frames = obj if isinstance(obj, Encoded) else numencode(obj)
+    for topic in topics:
+        self.send(topic, flags|zmq.SNDMORE)
+        self.send_multipart(frames, flags, copy=False)
+    return frames
+
+def numrecv_topic(self, **kwargs):
+    topic = self.recv()
+    return topic, numrecv(self, **kwargs)
+
+# Asynchronous
+# ============
+
+# The same framing for event loop sockets, ``zmq.asyncio`` sockets on
+# Python 3 or ``zmq.eventloop.future`` ( tornado ) ones. Their send and
+# recv return futures, so do these, ``await anumsend(sock, obj)``. A send
+# only completes once the socket takes the message, so the high-water
+# mark pushes back on the sender instead of buffering without bound.
+
+def _bytes(part):
+    return getattr(part, 'bytes', part)
+
+def numdecode(parts):
+    """
+    Decode the frames of one whole message sent by numsend or numencode,
+    as returned by recv_multipart.
+    """
+    magic = _bytes(parts[0])
+    if magic == NUMPYHDR:
+        return reductor.numpy_header_reconstruct(_bytes(parts[1]), parts[2:])
+    elif magic in [NUMPYND, NUMPY1D, NUMPY2D]:
+        md = numpy_metadata(*srl.loads(_bytes(parts[1])))
+        return reductor.numpy_reconstruct(md, parts[2])
+    elif magic == PANDAS:
+        md = pandas_metadata(*srl.loads(_bytes(parts[1])))
+        return reductor.pandas_reconstruct(md, parts[2])
+    else:
+        raise Exception("Unknown wire protocol")
+
+def _then(future, fn):
+    # Future of the same flavour resolving to fn(result)
+    result = type(future)()
+
+    def done(f):
+        if f.cancelled():
+            result.cancel()
+            return
+        try:
+            result.set_result(fn(f.result()))
+        except Exception as e:
+            result.set_exception(e)
+
+    def cancelled(r):
+        if r.cancelled():
+            future.cancel()
+
+    future.add_done_callback(done)
+    result.add_done_callback(cancelled)
+    return result
+
+def anumsend(self, obj, flags=0):
+    return self.send_multipart(numencode(obj), flags, copy=False)
+
+def anumrecv(self, flags=0, copy=True, track=False):
+    future = self.recv_multipart(flags, copy=copy, track=track)
+    return _then(future, numdecode)
@@ -18,6 +18,21 @@ extensions = [
         ["numpush/posix_io/splice.pyx"],
         include_dirs=[],
     ),
+    Extension(
+        "numpush.posix_io.rwlock",
+        ["numpush/posix_io/rwlock.pyx"],
+        include_dirs=[],
+    ),
+    Extension(
+        "numpush.posix_io.numa",
+        ["numpush/posix_io/numa.pyx"],
+        include_dirs=[],
+    ),
+    Extension(
+        "numpush.posix_io.ring",
+        ["numpush/posix_io/ring.pyx"],
+        include_dirs=[],
+    ),
     Extension(
         "numpush.posix_io.sendfile",
         ["numpush/posix_io/sendfile.pyx"],
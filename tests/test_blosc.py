@@ -1,13 +1,100 @@
 import zmq
-import zmq_blosc
-from numpy import linspace
+from numpy import linspace, arange, empty_like
+from numpush import zmq_blosc
 
 ctx = zmq_blosc.BloscContext()
 
-sock = ctx.socket(zmq.PUSH)
-sock.bind('tcp://127.0.0.1:5560')
+push = ctx.socket(zmq.PUSH)
+push.bind('tcp://127.0.0.1:5560')
 
-a = linspace(1, 100, 100)
-print a.dtype
+pull = ctx.socket(zmq.PULL)
+pull.connect('tcp://127.0.0.1:5560')
 
-sock.send(a)
+def test_roundtrip():
+    a = linspace(1, 100, 100)
+    push.send(a)
+    b = pull.recv(dtype=a.dtype)
+    assert (a == b).all()
+
+def test_empty():
+    a = arange(0)
+    push.send(a)
+    b = pull.recv(dtype=a.dtype)
+    assert len(b) == 0 and b.dtype == a.dtype
+
+def test_zerocopy_send():
+    a = arange(0, 100000)
+    push.send(a, copy=False)
+    out = empty_like(a)
+    b = pull.recv(out=out)
+    assert b is out
+    assert (a == out).all()
+
+def test_adaptive_policy():
+    sock = ctx.socket(zmq.PUSH, link_speed=125e6)
+    sock.bind('tcp://127.0.0.1:5561')
+    recv = ctx.socket(zmq.PULL)
+    recv.connect('tcp://127.0.0.1:5561')
+
+    # Empty payloads aren't sampled
+    sock.send(arange(0), stream='ints')
+    assert len(recv.recv()) == 0
+
+    a = arange(0, 100000)
+    for i in xrange(len(zmq_blosc.CANDIDATES)):
+        sock.send(a, stream='ints')
+        assert (recv.recv(dtype=a.dtype) == a).all()
+
+    stats = sock.stats['ints']
+    assert not stats['pending']
+    assert (stats['clevel'], stats['shuffle']) in zmq_blosc.CANDIDATES
+    assert stats['ratio'] > 1
+
+def test_chunked():
+    a = linspace(0, 1, 1000003)
+    push.send_chunked(a, blocksize=1 << 16)
+    b = pull.recv_chunked(dtype=a.dtype)
+    assert (a == b).all()
+
+    # Too small an output buffer leaves the socket usable
+    push.send_chunked(a, blocksize=1 << 16)
+    try:
+        pull.recv_chunked(out=empty_like(a[:10]))
+    except ValueError:
+        pass
+    else:
+        assert False
+    push.send(a[:10])
+    assert (pull.recv(dtype=a.dtype) == a[:10]).all()
+
+def test_chunked_round_robin():
+    import time
+    sock = ctx.socket(zmq.PUSH)
+    sock.bind('tcp://127.0.0.1:5562')
+    peers = [ctx.socket(zmq.PULL), ctx.socket(zmq.PULL)]
+    for peer in peers:
+        peer.connect('tcp://127.0.0.1:5562')
+    time.sleep(0.2)
+
+    # The header and the blocks are spread over both peers, neither
+    # may put together a transfer from what it got
+    a = linspace(0, 1, 20000)
+    sock.send_chunked(a, blocksize=a.nbytes // 2)
+    try:
+        peers[0].recv_chunked(dtype=a.dtype)
+    except zmq_blosc.ChunkedTransferError:
+        pass
+    else:
+        assert False
+
+def test_compressed_getitem():
+    a = arange(0, 1000000)
+    push.send(a)
+    ca = pull.recv_compressed(dtype=a.dtype)
+
+    assert len(ca) == len(a)
+    assert ca[12345] == a[12345]
+    assert ca[-1] == a[-1]
+    assert (ca[500000:500100] == a[500000:500100]).all()
+    assert (ca[900000:100000:-7] == a[900000:100000:-7]).all()
+    assert (ca.decompress() == a).all()
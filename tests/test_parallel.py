@@ -0,0 +1,41 @@
+import numpy as np
+from numpush import shmem
+from numpush.parallel import shared_map
+
+def rowsum(rows):
+    return rows.sum(axis=1)[:, None]
+
+def double(cols):
+    return cols * 2
+
+def test_shared_map():
+    data = np.arange(100000.).reshape(10000, 10)
+    result = shared_map(rowsum, data, nworkers=4, chunksize=100)
+    assert result.shape == (10000, 1)
+    assert (result[:, 0] == data.sum(axis=1)).all()
+
+def test_shared_out():
+    src = shmem.NamedNumpy(np.arange(1000.).reshape(10, 100), 'numpush_test_src')
+    out = shmem.create('numpush_test_out', (10, 100), np.float64)
+    try:
+        assert shared_map(double, src, axis=1, nworkers=2, out=out) is out
+        assert (out == src * 2).all()
+    finally:
+        shmem.unlink('numpush_test_src')
+        shmem.unlink('numpush_test_out')
+
+def test_numa():
+    from numpush.posix_io import numa
+
+    arr = shmem.RawNumpy(np.arange(100000.), numa='interleave')
+    assert numa.node_of(arr.ctypes.data) in numa.NODES
+
+    node = min(numa.NODES)
+    arr = shmem.create('numpush_test_numa', 100000, np.float64, numa=node)
+    try:
+        arr[:] = 1
+        assert numa.node_of(arr.ctypes.data) == node
+        result = shared_map(double, arr, nworkers=2, pin=True)
+        assert (result == 2).all()
+    finally:
+        shmem.unlink('numpush_test_numa')
@@ -0,0 +1,47 @@
+import os
+import time
+import numpy as np
+from numpush.posix_io.ring import SharedRing
+
+tick = np.dtype([('time', np.int64), ('price', np.float64)])
+
+def test_push_pop():
+    ring = SharedRing(tick, 8)
+    assert ring.push(np.zeros(5, dtype=tick)) == 5
+
+    batch = ring.pop(3)
+    assert len(batch) == 3 and len(ring) == 5
+    # Full until the last batch is released
+    assert ring.push(np.zeros(8, dtype=tick), timeout=0.01) == 3
+
+    assert len(ring.pop()) == 5
+    assert len(ring.pop(timeout=0.01)) == 0
+    assert len(ring) == 0
+
+def test_timeout():
+    ring = SharedRing(np.float64, 4)
+    start = time.time()
+    assert len(ring.pop(timeout=0.05)) == 0
+    assert time.time() - start >= 0.05
+
+def test_processes():
+    ring = SharedRing(tick, 1000)
+    n = 100000
+
+    pid = os.fork()
+    if pid == 0:
+        records = np.zeros(n, dtype=tick)
+        records['time'] = np.arange(n)
+        for i in xrange(0, n, 512):
+            ring.push(records[i:i + 512])
+        os._exit(0)
+
+    received = []
+    count = 0
+    while count < n:
+        batch = ring.pop()
+        received.append(batch['time'].copy())
+        count += len(batch)
+    os.waitpid(pid, 0)
+
+    assert (np.concatenate(received) == np.arange(n)).all()
@@ -0,0 +1,189 @@
+import os
+import time
+import numpy as np
+from threading import Thread
+from numpush.posix_io.rwlock import RWLock, StripedLock
+from numpush.shmem import RawNumpy
+
+def test_readers():
+    lock = RWLock()
+    # No reader limit
+    for i in xrange(1000):
+        assert lock.acquire_read()
+    assert lock.readers == 1000
+    assert not lock.acquire_write(timeout=0.01)
+    for i in xrange(1000):
+        lock.release_read()
+
+    with lock.writing():
+        # Writes nest and the writer may read
+        with lock.writing():
+            with lock:
+                assert lock.locked
+    assert not lock.locked and lock.readers == 0
+
+def test_writer_preference():
+    lock = RWLock()
+    lock.acquire_read()
+
+    t = Thread(target=lambda: lock.acquire_write() and lock.release_write())
+    t.start()
+    time.sleep(0.1)
+
+    # A waiting writer keeps new readers out
+    assert not lock.acquire_read(timeout=0.05)
+    lock.release_read()
+    t.join()
+    assert lock.acquire_read(timeout=0)
+
+def test_processes():
+    lock = RWLock()
+    counter = RawNumpy(np.zeros(1, dtype=np.int64))
+
+    pids = []
+    for i in xrange(4):
+        pid = os.fork()
+        if pid == 0:
+            for j in xrange(1000):
+                with lock.writing():
+                    counter[0] += 1
+            os._exit(0)
+        pids.append(pid)
+
+    for pid in pids:
+        os.waitpid(pid, 0)
+    assert counter[0] == 4000
+
+def test_striped():
+    from numpush.shmem_views import SyncNumpy
+    s = SyncNumpy(RawNumpy(np.zeros((100, 10))), nstripes=10)
+
+    # Holding the first half for writing doesn't block the second half
+    with s.region(slice(0, 50), write=True):
+        assert s._lock.acquire(5, 9, True, timeout=0)
+        s._lock.release(5, 9, True)
+        assert not s._lock.acquire(4, 4, False, timeout=0.01)
+
+    # Fancy keys lock everything
+    span = (0, s._span)
+    assert s._bounds([1, 2]) == s._bounds(np.arange(3)) == span
+    assert s._bounds(s.gather(slice(None)) > 0) == s._bounds(True) == span
+    assert s._bounds((slice(None), [0])) == span
+    assert s._bounds(1) == (80, 160)
+
+    # One timeout for the whole range, however many stripes wait
+    lock = StripedLock(4)
+    lock.acquire(0, 3, True)
+    def release():
+        for i in xrange(4):
+            time.sleep(0.15)
+            lock.release(i, i, True)
+    t = Thread(target=release)
+    t.start()
+    start = time.time()
+    assert not lock.acquire(0, 3, True, timeout=0.3)
+    assert time.time() - start < 0.5
+    t.join()
+
+    pid = os.fork()
+    if pid == 0:
+        s[:50] = 1
+        os._exit(0)
+    s[50:] = 2
+    os.waitpid(pid, 0)
+    assert s.sum() == 500 + 1000
+
+def test_batch():
+    from numpush.shmem_views import SyncNumpy
+    s = SyncNumpy(RawNumpy(np.arange(100.)), nstripes=10)
+
+    with s.batch_write() as a:
+        assert s._lock.acquire(9, 9, False, timeout=0.01) is False
+        for i in xrange(100):
+            a[i] = a[-i]
+
+    assert (s.gather([0, 1, 99]) == [0, 99, 99]).all()
+    try:
+        with s.batch_write([1, 3]) as a:
+            a[:] = 7
+    except IndexError:
+        pass
+    else:
+        assert False
+    copy = s.gather(slice(0, 10))
+    copy[0] = -5
+    assert s[0] == 0
+
+    # Scattering into the first rows leaves the last stripe free
+    with s._take_region([1, 2, 3], True):
+        assert s._lock.acquire(9, 9, True, timeout=0)
+        s._lock.release(9, 9, True)
+    s.scatter([1, 2, 3], -1)
+    assert s[1] == s[3] == -1
+
+    s.apply_ufunc(np.multiply, 2, where=s.gather(slice(None)) > 0)
+    assert s[1] == -1 and s[4] == 2 * 96
+
+def test_reentrant():
+    from numpush.shmem_views import SyncNumpy
+    s = SyncNumpy(RawNumpy(np.arange(100.)), nstripes=10)
+
+    # Nested access from the thread holding the lock goes through
+    with s.reading:
+        assert np.asarray(s).sum() == s.sum() == 4950
+    with s.writing():
+        s[0] = 1
+        with s.writing():
+            s.fill(2)
+        assert s[99] == 2
+    with s.batch_write(slice(0, 50)) as a:
+        a[:] = 3
+        assert s[10] == 3
+
+    # Upgrading a read to a write would deadlock
+    with s.reading:
+        try:
+            s[0] = 4
+        except RuntimeError:
+            pass
+        else:
+            assert False
+    assert s._local.get() == []
+
+    # Nesting a second range would deadlock against a thread nesting
+    # the other way round, it's refused
+    s = SyncNumpy(RawNumpy(np.zeros(1000)), nstripes=10)
+    errors = []
+    def nest(outer, inner):
+        try:
+            with s.batch_write(outer):
+                time.sleep(0.1)
+                s[inner] = 1
+        except RuntimeError as e:
+            errors.append(e)
+    threads = [Thread(target=nest, args=(slice(500, 600), 0)),
+               Thread(target=nest, args=(slice(0, 100), 550))]
+    for t in threads:
+        t.daemon = True
+        t.start()
+    for t in threads:
+        t.join(5)
+        assert not t.is_alive()
+    assert len(errors) == 2
+    assert s._lock.acquire(0, 9, True, timeout=0)
+
+def test_fork_holding():
+    from numpush.shmem_views import SyncNumpy
+    s = SyncNumpy(RawNumpy(np.zeros(100)), nstripes=10)
+
+    # The child doesn't inherit the parent's locks, it waits for them
+    with s.writing():
+        pid = os.fork()
+        if pid:
+            time.sleep(0.2)
+            s[0] = 5
+        else:
+            value = s[0]
+    if pid == 0:
+        os._exit(0 if value == 5 and s._local.get() == [] else 1)
+    assert os.waitpid(pid, 0)[1] == 0
@@ -2,18 +2,115 @@ import socket
 import numpy as np
 import os.path as path
 from tempfile import mkdtemp
-from numpush.posix_io.sendfile import posix_sendfile
+from threading import Thread
+from numpush.posix_io.sendfile import posix_sendfile, \
+    posix_sendfile_chunk, posix_sendfile_array, recv_memmap, SendfileError
 
-# Just vanilla TCP over IPV4
-sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-sock.connect(("127.0.0.1", 8000))
+def memmapped(data):
+    filename = path.join(mkdtemp(), 'map')
+    fp = np.memmap(filename, dtype=data.dtype, shape=data.shape, mode='w+')
+    fp[:] = data[:]
+    fp.flush()
+    return filename, fp
 
-filename = path.join(mkdtemp(), 'map')
-data = np.linspace(0, 1000)
+def receive(sock, nbytes, into):
+    while nbytes:
+        chunk = sock.recv(nbytes)
+        into.append(chunk)
+        nbytes -= len(chunk)
 
-fd = open(filename, 'a+')
-fp = np.memmap(filename, dtype=data.dtype, shape=data.shape)
-fp[:] = data[:]
+def test_sendfile():
+    # Unix domain socket pair standing in for TCP
+    sock, peer = socket.socketpair()
 
-sent = posix_sendfile(sock, fd, nbytes=1024)
-assert sent == data.nbytes
+    data = np.linspace(0, 1000)
+    filename, fp = memmapped(data)
+
+    fd = open(filename, 'rb')
+    sent = posix_sendfile(sock, fd, nbytes=1024)
+    assert sent == data.nbytes
+
+def test_sendfile_chunk():
+    sock, peer = socket.socketpair()
+
+    data = np.arange(0, 1000000)
+    filename, fp = memmapped(data)
+
+    received = []
+    t = Thread(target=receive, args=(peer, data.nbytes, received))
+    t.start()
+
+    progress = []
+    with open(filename, 'rb') as fd:
+        end = posix_sendfile_chunk(sock, fd, chunksize=1 << 16,
+                progress=lambda *a: progress.append(a))
+    t.join()
+
+    assert end == data.nbytes
+    assert progress[-1] == (data.nbytes, 0)
+    assert np.frombuffer(b''.join(received), dtype=data.dtype).tolist() \
+        == data.tolist()
+
+def test_sendfile_array():
+    sock, peer = socket.socketpair()
+
+    data = np.linspace(0, 1, 100000).reshape(1000, 100)
+    filename, fp = memmapped(data)
+
+    result = []
+    t = Thread(target=lambda: result.append(
+        recv_memmap(peer, path.join(mkdtemp(), 'recv.npy'))))
+    t.start()
+    posix_sendfile_array(sock, fp[10:20])
+    t.join()
+
+    mm, = result
+    assert mm.shape == (10, 100)
+    assert (mm == data[10:20]).all()
+
+def test_sendfile_hdtr():
+    # TCP so that the socket is corked around the transfer
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    sock = socket.create_connection(listener.getsockname())
+    peer, _ = listener.accept()
+
+    data = np.arange(0, 100000)
+    filename, fp = memmapped(data)
+
+    headers = [b'head', b'er']
+    trailers = [b'trailer']
+    total = 6 + data.nbytes + 7
+
+    received = []
+    t = Thread(target=receive, args=(peer, total, received))
+    t.start()
+    with open(filename, 'rb') as fd:
+        sent = posix_sendfile(sock, fd, nbytes=data.nbytes,
+                headers=headers, trailers=trailers)
+    t.join()
+
+    received = b''.join(received)
+    assert sent == total
+    assert received[:6] == b'header'
+    assert received[-7:] == b'trailer'
+    assert np.frombuffer(received[6:-7], dtype=data.dtype).tolist() \
+        == data.tolist()
+
+def test_hdtr_timeout():
+    # The peer never reads, the headers fill the socket buffer
+    sock, peer = socket.socketpair()
+    sock.setblocking(0)
+
+    data = np.arange(0, 1000)
+    filename, fp = memmapped(data)
+
+    with open(filename, 'rb') as fd:
+        try:
+            posix_sendfile_chunk(sock, fd, timeout=100,
+                    headers=[b'x' * (16 << 20)])
+        except SendfileError as e:
+            assert e.offset == 0
+        else:
+            assert False
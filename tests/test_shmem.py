@@ -0,0 +1,101 @@
+import os
+import sys
+import pickle
+import subprocess
+import numpy as np
+from numpush import shmem
+
+def test_named_attach():
+    a = shmem.NamedNumpy(np.arange(0, 100), 'numpush_test_named')
+    try:
+        # An unrelated process attaches by name and writes through
+        subprocess.check_call([sys.executable, '-c',
+            'from numpush import shmem; shmem.attach("numpush_test_named")[0] = -1'])
+        assert a[0] == -1
+
+        b = shmem.attach('numpush_test_named', readonly=True)
+        assert not b.flags.writeable
+        assert (a == b).all()
+    finally:
+        shmem.unlink('numpush_test_named')
+
+def test_pickle_view():
+    a = shmem.create('numpush_test_pickle', (10, 10), np.float64)
+    try:
+        a[:] = 0
+        v = pickle.loads(pickle.dumps(a[2:4, ::2], 2))
+        v[:] = 1
+        assert a[2:4, ::2].sum() == v.size
+        assert a.sum() == v.size
+    finally:
+        shmem.unlink('numpush_test_pickle')
+
+def test_shared_frame():
+    from pandas import DataFrame, date_range
+
+    n = 1000
+    df = DataFrame({
+        'a': np.arange(n),
+        'b': np.linspace(0, 1, n),
+        'c': np.arange(n, dtype=np.int32),
+        'd': np.linspace(1, 2, n),
+    }, index=date_range('2012-01-01', periods=n, freq='T', name='t'))
+
+    desc = shmem.share_frame(df, 'numpush_test_frame')
+    try:
+        # One segment per dtype, the index travels by name
+        assert len(desc.blocks) == 3
+        assert len(pickle.dumps(desc, 2)) < 1024
+
+        sdf = shmem.attach_frame(pickle.loads(pickle.dumps(desc, 2)))
+        assert sdf.equals(df)
+        assert sdf.index.equals(df.index)
+
+        shmem.attach_frame(desc)['b'].values[0] = -1
+        assert sdf['b'].values[0] == -1
+    finally:
+        shmem.unlink_frame(desc)
+
+def test_shared_frame_cleanup():
+    from pandas import DataFrame
+
+    df = DataFrame({'a': np.arange(10), 'b': np.linspace(0, 1, 10)})
+    name = 'numpush_test_frame_cleanup'
+
+    def leftover():
+        return [f for f in os.listdir('/dev/shm') if f.startswith(name)]
+
+    # Unshareable dtypes are refused before any segment is created
+    mixed = df.copy()
+    mixed['c'] = ['x'] * 10
+    try:
+        shmem.share_frame(mixed, name)
+    except TypeError:
+        pass
+    else:
+        assert False
+    assert leftover() == []
+
+    # A segment failing part way takes the ones before it along
+    shmem.create(name + '.block1', 1, np.int8)
+    try:
+        shmem.share_frame(df, name)
+    except OSError:
+        pass
+    else:
+        assert False
+    finally:
+        shmem.unlink(name + '.block1')
+    assert leftover() == []
+
+def test_huge_pages():
+    from numpush.shmem_stat import huge_pages
+
+    data = np.arange(1000000.)
+    a = shmem.RawNumpy(data, huge=True)
+    assert (a == data).all()
+
+    # Whether we got them depends on the kernel configuration
+    stat = huge_pages(a)
+    assert stat['size'] >= a.nbytes
+    assert stat['huge'] == bool(stat['hugetlb'] or stat['transparent'])
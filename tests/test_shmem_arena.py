@@ -0,0 +1,39 @@
+import os
+import numpy as np
+from numpush.shmem_arena import SharedHeap
+
+def test_reuse():
+    heap = SharedHeap(arena_size=1 << 20)
+
+    a = heap.empty((100, 10))
+    assert a.ctypes.data % 64 == 0
+    address = a.ctypes.data
+    heap.release(a)
+
+    # Same size class comes straight off the free list
+    b = heap.empty(900, dtype=np.float64)
+    assert b.ctypes.data == address
+    assert heap.stats()['arenas'] == 1
+
+    # Larger than a quarter arena gets its own mapping
+    big = heap.empty(1 << 19, dtype=np.uint8)
+    assert heap.stats()['arenas'] == 1
+    heap.release(big)
+    heap.release(b)
+
+    stats = heap.stats()
+    assert stats['blocks'] == 0
+    assert stats['free'] == stats['carved']
+
+def test_fork():
+    heap = SharedHeap(arena_size=1 << 20)
+    a = heap.empty(1000, dtype=np.int64)
+    a[:] = 0
+
+    pid = os.fork()
+    if pid == 0:
+        a[:] = np.arange(1000)
+        os._exit(0)
+    os.waitpid(pid, 0)
+
+    assert (a == np.arange(1000)).all()
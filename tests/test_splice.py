@@ -4,11 +4,15 @@ import _multiprocessing
 import sys
 import os
 import socket
+from threading import Thread
 sys.path.append(os.getcwd())
 from numpush.posix_io.splice import \
     posix_splice, \
     posix_splice_thread, \
     posix_splice_sockets, \
+    posix_splice_relay_thread, \
+    posix_vmsplice, \
+    posix_vmsplice_send, \
     SPLICE_MORE, SPLICE_MOVE
 
 DATA= 'a'*1024
@@ -52,3 +56,80 @@ def test_multithreaded():
     finally:
         os.unlink('w')
         os.unlink('r')
+
+def test_relay_thread():
+    # ingest => [ a | b ] => relay => [ c | d ] => compute
+    a, b = socket.socketpair()
+    c, d = socket.socketpair()
+
+    thread = posix_splice_relay_thread(b, c)
+
+    payload = DATA * 1024
+
+    def ingest():
+        a.sendall(payload)
+        a.shutdown(socket.SHUT_WR)
+
+    Thread(target=ingest).start()
+
+    received = []
+    while sum(map(len, received)) < len(payload):
+        received.append(d.recv(len(payload)))
+
+    assert thread.join() == 0
+    assert thread.nbytes == len(payload)
+    assert thread.calls >= 2
+    assert ''.join(received) == payload
+
+def test_vmsplice():
+    import numpy as np
+    from numpush.shmem import RawNumpy
+
+    r, w = os.pipe()
+    a = np.arange(0, 1000)
+    assert posix_vmsplice(a, w) == a.nbytes
+    assert (np.frombuffer(os.read(r, a.nbytes), dtype=a.dtype) == a).all()
+
+    sock, peer = socket.socketpair()
+    b = RawNumpy(np.linspace(0, 1, 1000000))
+
+    received = []
+    def consume():
+        n = b.nbytes
+        while n:
+            received.append(peer.recv(n))
+            n -= len(received[-1])
+
+    t = Thread(target=consume)
+    t.start()
+    nbytes, calls = posix_vmsplice_send(b, sock, gift=True)
+    t.join()
+
+    assert nbytes == b.nbytes
+    assert (np.frombuffer(''.join(received), dtype=b.dtype) == b).all()
+
+def test_vmsplice_unaligned():
+    import numpy as np
+
+    # Start off a page boundary so every chunk straddles an extra page
+    raw = np.empty(8 + 8 * 100000, dtype=np.uint8)
+    a = raw[8:].view(np.float64)
+    a[:] = np.linspace(0, 1, 100000)
+    assert a.ctypes.data % 4096 and a.nbytes > 64 * 1024
+
+    sock, peer = socket.socketpair()
+
+    received = []
+    def consume():
+        n = a.nbytes
+        while n:
+            received.append(peer.recv(n))
+            n -= len(received[-1])
+
+    t = Thread(target=consume)
+    t.start()
+    nbytes, calls = posix_vmsplice_send(a, sock)
+    t.join()
+
+    assert nbytes == a.nbytes
+    assert (np.frombuffer(''.join(received), dtype=a.dtype) == a).all()
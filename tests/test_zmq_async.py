@@ -0,0 +1,34 @@
+import zmq
+import numpy as np
+from pandas import DataFrame
+from tornado import gen
+from tornado.ioloop import IOLoop
+from zmq.eventloop.future import Context
+
+from numpush.zmq_net import anumsend, anumrecv
+
+# zmq.asyncio sockets work the same way on Python 3
+
+ctx = Context.instance()
+
+@gen.coroutine
+def roundtrip(objs):
+    a = ctx.socket(zmq.PAIR)
+    a.bind('inproc://async')
+    b = ctx.socket(zmq.PAIR)
+    b.connect('inproc://async')
+
+    for obj in objs:
+        yield anumsend(a, obj)
+    received = []
+    for obj in objs:
+        received.append((yield anumrecv(b, copy=False)))
+    raise gen.Return(received)
+
+def test_roundtrip():
+    nd = np.arange(1000.).reshape(10, 100)[:, ::2]
+    df = DataFrame({'a': [1,2,3], 'b': [4,5,6]})
+
+    rnd, rdf = IOLoop.current().run_sync(lambda: roundtrip([nd, df]))
+    assert (rnd == nd).all()
+    assert (rdf.values == df.values).all()
@@ -0,0 +1,209 @@
+import zmq
+import numpy as np
+from pandas import DataFrame
+
+from numpush.zmq_net import numsend, numrecv, numsend_many, numrecv_many
+
+ctx = zmq.Context.instance()
+
+def pair(addr):
+    a = ctx.socket(zmq.PAIR)
+    a.bind(addr)
+    b = ctx.socket(zmq.PAIR)
+    b.connect(addr)
+    return a, b
+
+def test_batch():
+    a, b = pair('inproc://batch')
+
+    nd1 = np.arange(10)
+    nd2 = np.linspace(0, 1, 12).reshape(3, 4)
+    df = DataFrame({'a': [1,2,3], 'b': [4,5,6]})
+
+    numsend_many(a, [nd1, nd2, df])
+    rnd1, rnd2, rdf = numrecv_many(b)
+
+    assert (rnd1 == nd1).all()
+    assert (rnd2 == nd2).all()
+    assert (rdf.values == df.values).all()
+    assert rdf.columns.tolist() == df.columns.tolist()
+
+def test_batch_layouts():
+    a, b = pair('inproc://batch_layouts')
+
+    m = np.arange(2000000.).reshape(500, 4000)
+    rec = np.zeros(10, dtype=[('px', '<f8'), ('qty', '<i4', (2,))])
+    rec['px'] = np.arange(10)
+
+    # Transposed, strided ( one frame per row ) and a record dtype
+    objs = [m.T, m[::2], rec, np.arange(5)]
+    numsend_many(a, objs)
+    received = numrecv_many(b, copy=False)
+
+    assert len(received) == len(objs)
+    for nd, rnd in zip(objs, received):
+        assert rnd.dtype == nd.dtype
+        assert rnd.shape == nd.shape
+        assert (rnd == nd).all()
+
+def test_empty_batch():
+    a, b = pair('inproc://empty_batch')
+
+    numsend_many(a, [])
+    assert numrecv_many(b) == []
+
+def test_zerocopy_recv():
+    a, b = pair('inproc://zerocopy')
+
+    nd = np.linspace(0, 1, 1000)
+    numsend(a, nd)
+    rnd = numrecv(b, copy=False)
+
+    # Built on the frame, which is kept alive as the base
+    base = rnd
+    while isinstance(base, np.ndarray):
+        base = base.base
+    assert isinstance(base, zmq.Frame)
+    assert (rnd == nd).all()
+
+    df = DataFrame({'a': [1,2,3], 'b': [4,5,6]})
+    numsend(a, df)
+    rdf = numrecv(b, copy=False)
+    assert (rdf.values == df.values).all()
+
+def test_wire_header():
+    a, b = pair('inproc://wire_header')
+
+    rec = np.dtype([('time', '<M8[ns]'), ('px', '>f8'), ('qty', '<i4', (2,))],
+                   align=True)
+    records = np.zeros(10, dtype=rec)
+    records['px'] = np.arange(10)
+
+    m = np.arange(60.).reshape(3, 4, 5)
+    for nd in [records, m.T, m[::-1], np.asfortranarray(m), np.arange(0)]:
+        numsend(a, nd)
+        rnd = numrecv(b, copy=False)
+        assert rnd.dtype == nd.dtype
+        assert rnd.strides == nd.strides
+        assert (rnd == nd).all()
+
+def test_wire_magic():
+    from numpush.zmq_net import NUMPYHDR, BATCH, srl
+
+    a, b = pair('inproc://wire_magic')
+    nd = np.arange(10.)
+
+    numsend(a, nd)
+    parts = b.recv_multipart()
+    assert parts[0] == NUMPYHDR and parts[1][:2] == b'NW'
+
+    # Batch entries tagged NUMPYHDR carry the binary header too
+    numsend_many(a, [nd])
+    parts = b.recv_multipart()
+    (magic, md, nframes), = srl.loads(parts[1])
+    assert parts[0] == BATCH
+    assert magic == NUMPYHDR and md[:2] == b'NW' and nframes == 1
+
+def test_strided():
+    from numpush import reductor
+
+    a, b = pair('inproc://strided')
+    m = np.arange(2000000.).reshape(500, 4000)
+
+    # Every other row, 32KB runs a frame each
+    header, frames = reductor.numpy_header_reduce(m[::2, :])
+    assert len(frames) == 250 and np.may_share_memory(frames[0], m)
+
+    # Every other column, packed
+    header, frames = reductor.numpy_header_reduce(m[:, ::2])
+    assert len(frames) == 1
+
+    for nd in [m[::2], m[:, ::2], m.T[::3], m[10:20, 5:600]]:
+        numsend(a, nd)
+        rnd = numrecv(b, copy=False)
+        assert rnd.shape == nd.shape
+        assert (rnd == nd).all()
+
+    # Same memory order as the sender's view
+    numsend(a, m.T[::3])
+    assert numrecv(b).flags.f_contiguous
+
+class Recording(object):
+    # Keeps every multipart message sent through it
+
+    def __init__(self, socket):
+        self.socket = socket
+        self.sent = []
+
+    def send_multipart(self, parts, *args, **kwargs):
+        self.sent.append(parts)
+        return self.socket.send_multipart(parts, *args, **kwargs)
+
+def test_delta():
+    from numpush.zmq_net import DeltaSender, DeltaReceiver, DeltaMismatch
+
+    a, b = pair('inproc://delta')
+    for xor in (False, True):
+        sock = Recording(a)
+        sender = DeltaSender(sock, blocksize=4096, xor=xor)
+        receiver = DeltaReceiver(b)
+
+        state = np.zeros((1000, 100))
+        sender.send(b'state', state)
+        key, rstate = receiver.recv()
+        assert key == b'state' and (rstate == state).all()
+
+        state[10] = 1
+        state[500:502] = 2
+        sender.send(b'state', state)
+        # Only the blocks under rows 10 and 500-501 go out, two each
+        assert sum(len(p) for p in sock.sent[-1][5:]) == 4 * 4096 < state.nbytes
+        assert receiver.recv()[1] is rstate
+        assert (rstate == state).all()
+
+    # Changing the array before it has been received doesn't throw the
+    # receiver off the sender's baseline
+    for xor in (False, True):
+        sender = DeltaSender(a, blocksize=4096, xor=xor)
+        receiver = DeltaReceiver(b)
+
+        state = np.zeros(10000)
+        sender.send(b'state', state)
+        state[5] = 7
+        sender.send(b'state', state)
+        receiver.recv()
+        key, rstate = receiver.recv()
+        assert (rstate == state).all()
+
+    # A receiver that missed the snapshot can't apply deltas
+    sender.send(b'state', state)
+    try:
+        DeltaReceiver(b).recv()
+    except DeltaMismatch:
+        pass
+    else:
+        assert False
+
+def test_fanout():
+    import time
+    from numpush.zmq_net import numencode, numpublish, numrecv_topic
+
+    pub = ctx.socket(zmq.PUB)
+    pub.bind('inproc://fanout')
+    sub = ctx.socket(zmq.SUB)
+    sub.connect('inproc://fanout')
+    sub.setsockopt(zmq.SUBSCRIBE, b'prices.')
+    time.sleep(0.1)
+
+    nd = np.arange(100.)
+    df = DataFrame({'a': [1,2,3], 'b': [4,5,6]})
+
+    frames = numencode(nd)
+    numpublish(pub, [b'prices.a', b'volumes.a', b'prices.b'], frames)
+    numpublish(pub, [b'prices.c'], df)
+
+    received = [numrecv_topic(sub) for i in range(3)]
+    assert [topic for topic, obj in received] == \
+        [b'prices.a', b'prices.b', b'prices.c']
+    assert (received[1][1] == nd).all()
+    assert (received[2][1].values == df.values).all()